@@ -4,7 +4,7 @@ Simple Library Management API
 Propósito: Demostrar herramientas DevOps en contexto real
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, g, jsonify, request
 import logging
 import random
 import time
@@ -45,6 +45,14 @@ def log_request():
     global request_count
     request_count += 1
     logger.info(f"Request #{request_count}: {request.method} {request.path} from {request.remote_addr}")
+    g.cpu_start = time.thread_time()
+
+@app.after_request
+def add_server_timing(response):
+    # CPU time spent on the request, reported to the health checker
+    cpu_ms = (time.thread_time() - g.cpu_start) * 1000
+    response.headers['Server-Timing'] = f"cpu;dur={cpu_ms:.2f}"
+    return response
 
 @app.route('/')
 def home():
@@ -91,10 +99,13 @@ def health():
 def get_books():
     # Get all books
     logger.info(f"Fetching all books - Total: {len(books_db)}")
-    return jsonify({
+    response = jsonify({
         "books": books_db,
         "total": len(books_db)
     })
+    # ETag so that monitors can poll with conditional GETs (304 Not Modified)
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/api/books/<int:book_id>', methods=['GET'])
 def get_book(book_id):
@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+"""
+Health Check Benchmark
+cycle time, probes/sec, CPU and memory of the health check monitor against a
+local stub server, at several fleet sizes, with JSON baselines so that
+regressions show up
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import health_check
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+SIZES = (10, 100, 1000, 10000)
+MODES = ("run", "continuous", "async", "processes")
+DEFAULT_MODES = ("run", "continuous", "async")
+REGRESSION_TOLERANCE = 0.2  # relative change that counts as a regression
+
+class StubServer:
+    """
+    Keep-alive HTTP/1.1 server on its own event loop thread
+    Every response waits latency seconds before it is sent. A fraction
+    error_rate of the requests get a 500, a fraction timeout_rate get no
+    response at all (the connection stays open until the client gives up).
+    Bodies are body_size bytes of JSON. It listens on ports ports, which the
+    monitor counts as that many hosts.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, timeout_rate=0.0, body_size=0,
+                 host="127.0.0.1", seed=0, ports=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.host = host
+        self.ports = [None] * ports
+        self.port = None
+        self.requests = 0
+        self._ok = self._response("200 OK", make_body(body_size, "healthy"))
+        self._error = self._response("500 Internal Server Error", make_body(body_size, "unhealthy"))
+        self._random = random.Random(seed)
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _response(status, body):
+        return (
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode('latin-1') + body
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def urls(self):
+        """Base URL of every port"""
+        return [f"http://{self.host}:{port}" for port in self.ports]
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _shutdown(self):
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        servers = [
+            self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, 0, backlog=4096)
+            )
+            for _ in self.ports
+        ]
+        self.ports = [server.sockets[0].getsockname()[1] for server in servers]
+        self.port = self.ports[0]
+        self._ready.set()
+        self._loop.run_forever()
+        for server in servers:
+            server.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                await reader.readuntil(b'\r\n\r\n')
+                self.requests += 1
+                roll = self._random.random()
+                if roll < self.timeout_rate:
+                    await reader.read()  # until the client hangs up
+                    break
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(self._error if roll < self.timeout_rate + self.error_rate else self._ok)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+def make_body(size, status):
+    """JSON body of at least size bytes"""
+    body = json.dumps({"status": status}).encode()
+    if len(body) < size:
+        padding = size - len(body) - len(', "padding": ""')
+        body = json.dumps({"status": status, "padding": "x" * max(0, padding)}).encode()
+    return body
+
+def raise_file_limit():
+    """Allow as many open sockets as the hard limit permits"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def make_endpoints(base_url, count, timeout=30):
+    """count distinct endpoints on the stub server, spread over base_url when it is a list"""
+    base_urls = [base_url] if isinstance(base_url, str) else base_url
+    return [
+        {"name": f"bench-{i}", "url": f"{base_urls[i % len(base_urls)]}/health/{i}",
+         "expected_status": 200, "timeout": timeout}
+        for i in range(count)
+    ]
+
+def _failures(results):
+    return sum(1 for r in results if not r.get('success', False))
+
+def bench_threads(endpoints, rounds, workers, per_host):
+    """
+    Run rounds cycles of run_health_checks with a thread pool
+    Returns: dictionary with the time of each cycle, probes and failures
+    """
+    pool = health_check.SessionPool(workers)
+    cycles, failures = [], 0
+    try:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            results = health_check.run_health_checks(endpoints, max_workers=workers, pool=pool,
+                                                     per_host=per_host)
+            cycles.append(time.perf_counter() - start)
+            failures += _failures(results)
+    finally:
+        pool.close()
+    return {"cycles": cycles, "probes": len(endpoints) * rounds, "failures": failures}
+
+def bench_continuous(endpoints, rounds, workers, per_host, interval):
+    """
+    Run continuous_monitoring for rounds intervals
+    A cycle lasts from its deadline to the last result of the cycle; the
+    interval must be longer than a cycle
+    Returns: dictionary with the time of each cycle, probes and failures
+    """
+    finished = []  # (monotonic time, success) of each result
+    def listener(result):
+        finished.append((time.monotonic(), result.get('success', False)))
+
+    saved_endpoints = health_check.ENDPOINTS
+    health_check.ENDPOINTS = endpoints
+    health_check.RESULT_LISTENERS.append(listener)
+    start = time.monotonic()
+    try:
+        # pool_size as in bench_threads' SessionPool(workers), so both modes run the same setup
+        health_check.continuous_monitoring(interval, workers, pool_size=workers,
+                                           per_host=per_host, duration=rounds * interval)
+    finally:
+        health_check.RESULT_LISTENERS.remove(listener)
+        health_check.ENDPOINTS = saved_endpoints
+
+    ends = {}  # cycle -> time of its last result
+    for at, _ in finished:
+        cycle = int((at - start) // interval)
+        ends[cycle] = max(ends.get(cycle, at), at)
+    return {
+        "cycles": [end - (start + cycle * interval) for cycle, end in sorted(ends.items())],
+        "probes": len(finished),
+        "failures": sum(1 for _, ok in finished if not ok),
+    }
+
+def bench_async(endpoints, rounds, concurrency, per_host):
+    """
+    Run rounds cycles of async_run_health_checks on one event loop
+    Returns: dictionary with the time of each cycle, probes, failures and
+    connections opened
+    """
+    async def run():
+        pool = health_check.AsyncConnectionPool(per_host)
+        cycles, failures = [], 0
+        try:
+            for _ in range(rounds):
+                start = time.perf_counter()
+                results = await health_check.async_run_health_checks(
+                    endpoints, concurrency, per_host, pool=pool
+                )
+                cycles.append(time.perf_counter() - start)
+                failures += _failures(results)
+            return cycles, failures, pool.opened
+        finally:
+            pool.close()
+
+    cycles, failures, opened = asyncio.run(run())
+    return {"cycles": cycles, "probes": len(endpoints) * rounds, "failures": failures,
+            "connections": opened}
+
+def bench_processes(endpoints, rounds, processes, threads, per_host):
+    """
+    Run rounds cycles of run_health_checks on a ProcessProbePool
+    Each host is probed by one worker: spread the endpoints over at least
+    processes hosts to use them all
+    Worker start-up, warm-up and shutdown are measured on a pool that does
+    nothing else; startup_cpu (that pool, and the same again for the
+    measured one) is for measure() to leave out
+    Returns: dictionary with the time of each cycle (worker start-up
+    excluded), probes, failures and startup_cpu
+    """
+    warm_up = endpoints[:processes * threads]  # hosts take turns in make_endpoints
+    startup_cpu = process_cpu()
+    pool = health_check.ProcessProbePool(processes, threads)
+    try:
+        health_check.run_health_checks(warm_up, pool=pool, per_host=per_host)
+    finally:
+        pool.close()
+    startup_cpu = 2 * (process_cpu() - startup_cpu)
+    
+    pool = health_check.ProcessProbePool(processes, threads)
+    cycles, failures = [], 0
+    try:
+        health_check.run_health_checks(warm_up, pool=pool, per_host=per_host)
+        for _ in range(rounds):
+            start = time.perf_counter()
+            results = health_check.run_health_checks(endpoints, pool=pool, per_host=per_host)
+            cycles.append(time.perf_counter() - start)
+            failures += _failures(results)
+    finally:
+        pool.close()
+    return {"cycles": cycles, "probes": len(endpoints) * rounds, "failures": failures,
+            "startup_cpu": startup_cpu}
+
+def process_cpu():
+    """CPU seconds of this process and its finished children"""
+    if resource is None:
+        return time.process_time()
+    return sum(
+        usage.ru_utime + usage.ru_stime
+        for usage in (resource.getrusage(resource.RUSAGE_SELF),
+                      resource.getrusage(resource.RUSAGE_CHILDREN))
+    )
+
+def peak_rss_mb(who=None):
+    """
+    Peak resident memory in MiB, None when unknown
+    Args:
+        who: resource.RUSAGE_SELF (default) or resource.RUSAGE_CHILDREN,
+             the largest of the finished children
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1) or None
+
+def measure(bench, *args):
+    """
+    Run a bench_* function and add cycle time, probes/sec and resource usage
+    CPU includes worker processes, less the startup_cpu the bench reports.
+    Peaks are lifetime peaks: call it through measure_isolated()
+    Returns: dictionary of measurements
+    """
+    cpu = process_cpu()
+    outcome = bench(*args)
+    cpu = process_cpu() - cpu - outcome.pop('startup_cpu', 0)
+    cycles = outcome.pop('cycles')
+    busy = sum(cycles)
+    probes = outcome['probes']
+    return {
+        "cycle_s": round(busy / len(cycles), 3) if cycles else None,
+        "cycle_max_s": round(max(cycles), 3) if cycles else None,
+        "probes_per_sec": round(probes / busy, 1) if busy else None,
+        "cpu_s": round(cpu, 3),
+        "cpu_ms_per_probe": round(cpu / probes * 1000, 3) if probes else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "worker_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+        **outcome,
+    }
+
+def _measure_child(results, bench, args):
+    raise_file_limit()
+    health_check.LOG_FILE = os.devnull
+    health_check.configure_logging(buffered=True, console=False)
+    results.put(measure(bench, *args))
+
+def measure_isolated(bench, *args):
+    """
+    measure() in a fresh process, so that peak RSS and CPU are this run's
+    alone and the stub server (in this process) is left out; its import is
+    not measured
+    Returns: dictionary of measurements
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure_child, args=(results, bench, args))
+    process.start()
+    try:
+        while True:
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"The {bench.__name__} benchmark process exited")
+    finally:
+        process.join()
+
+def run_suite(base_urls, settings):
+    """
+    Benchmark every mode at every size, each run in its own process
+    Returns: measurements by "mode/size"
+    """
+    results = {}
+    for size in settings['sizes']:
+        endpoints = make_endpoints(base_urls, size, settings['probe_timeout'])
+        for mode in settings['modes']:
+            if mode == "run":
+                result = measure_isolated(bench_threads, endpoints, settings['rounds'],
+                                          settings['workers'], settings['per_host'])
+            elif mode == "continuous":
+                # long enough for a cycle, judging from the threaded run
+                run = results.get(f"run/{size}") or measure_isolated(
+                    bench_threads, endpoints, 1, settings['workers'], settings['per_host'])
+                interval = max(1, math.ceil(run['cycle_max_s'] * 1.5))
+                result = measure_isolated(bench_continuous, endpoints, settings['rounds'],
+                                          settings['workers'], settings['per_host'], interval)
+                result['interval_s'] = interval
+            elif mode == "async":
+                result = measure_isolated(bench_async, endpoints, settings['rounds'],
+                                          settings['concurrency'], settings['per_host'])
+            else:
+                result = measure_isolated(bench_processes, endpoints, settings['rounds'],
+                                          settings['processes'], settings['process_threads'],
+                                          settings['per_host'])
+            results[f"{mode}/{size}"] = result
+            print(format_result(mode, size, result), flush=True)
+    return results
+
+def format_result(mode, size, result):
+    rss, worker_rss = (
+        f"{result.get(key):>8.1f}" if result.get(key) is not None else f"{'-':>8}"
+        for key in ("peak_rss_mb", "worker_rss_mb")
+    )
+    return (
+        f"{size:>9} {mode:<11} {result['cycle_s']:>9.3f} {result['probes_per_sec']:>10,.0f} "
+        f"{result['cpu_s']:>8.2f} {result['cpu_ms_per_probe']:>9.3f} {rss} {worker_rss} "
+        f"{result['failures']:>7}"
+    )
+
+RESULT_HEADER = (
+    f"{'endpoints':>9} {'mode':<11} {'cycle s':>9} {'probes/s':>10} "
+    f"{'CPU s':>8} {'CPU ms/pr':>9} {'RSS MiB':>8} {'wkr MiB':>8} {'failed':>7}"
+)
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Regressions of results against a saved baseline: probes/sec lower, or CPU
+    per probe or peak RSS (the monitor's or its workers') higher, by more than
+    tolerance
+    Returns: list of messages, empty when there is none
+    """
+    regressions = []
+    checks = (("probes_per_sec", -1), ("cpu_ms_per_probe", 1), ("peak_rss_mb", 1), ("worker_rss_mb", 1))
+    for key, result in results.items():
+        old = baseline['results'].get(key)
+        if old is None:
+            continue
+        for metric, direction in checks:
+            before, after = old.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change * direction > tolerance:
+                regressions.append(f"{key} {metric}: {before} -> {after} ({change:+.0%})")
+    return regressions
+
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Health Check Benchmark")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)),
+                        help="comma-separated numbers of endpoints (default: 10,100,1000,10000)")
+    parser.add_argument("--modes", default=",".join(DEFAULT_MODES),
+                        help="comma-separated monitors to run: run (run_health_checks with "
+                             "threads), continuous, async, processes (default: run,continuous,async)")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="cycles to run per size and mode (default: 3)")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="seconds the stub server waits before each response (default: 0.01)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with a 500 (default: 0)")
+    parser.add_argument("--timeout-rate", type=float, default=0.0,
+                        help="fraction of requests never answered (default: 0)")
+    parser.add_argument("--body-size", type=int, default=0,
+                        help="response body size in bytes (default: a small JSON status)")
+    parser.add_argument("--hosts", type=int, default=1,
+                        help="stub server ports the endpoints are spread over, each a host "
+                             "to the monitor; the processes mode probes each host on one worker "
+                             "(default: 1)")
+    parser.add_argument("--probe-timeout", type=float, default=2,
+                        help="timeout of each probe in seconds (default: 2)")
+    parser.add_argument("--concurrency", type=int, default=health_check.ASYNC_CONCURRENCY,
+                        help="async checks in flight at once")
+    parser.add_argument("--per-host", type=int, default=health_check.ASYNC_PER_HOST,
+                        help="checks in flight to the stub server")
+    parser.add_argument("--workers", type=int, default=50,
+                        help="threads for the run and continuous modes (default: 50)")
+    parser.add_argument("--processes", type=int, default=2,
+                        help="worker processes for the processes mode (default: 2)")
+    parser.add_argument("--process-threads", type=int, default=health_check.PROCESS_THREADS,
+                        help="checks in flight in each worker process")
+    parser.add_argument("--save", metavar="FILE",
+                        help="save the results as a JSON baseline")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare with a saved baseline, exit with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help=f"relative change that counts as a regression (default: {REGRESSION_TOLERANCE})")
+    args = parser.parse_args(argv)
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    args.modes = args.modes.split(',')
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error(f"unknown mode {mode!r}, choose from {', '.join(MODES)}")
+    if ("run" in args.modes or "continuous" in args.modes) and health_check.requests is None:
+        parser.error("the run and continuous modes need requests")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    raise_file_limit()
+
+    settings = {key: value for key, value in vars(args).items()
+                if key not in ("save", "baseline", "tolerance")}
+    server = StubServer(args.latency, args.error_rate, args.timeout_rate, args.body_size,
+                        ports=args.hosts)
+    server.start()
+    print(f"{args.rounds} rounds, {args.latency * 1000:.0f}ms server latency, "
+          f"{args.error_rate:.0%} errors, {args.timeout_rate:.0%} timeouts")
+    print(RESULT_HEADER)
+    try:
+        results = run_suite(server.urls, settings)
+    finally:
+        server.stop()
+
+    report = {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": settings,
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != settings:
+            print("Warning: the baseline was recorded with different settings", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
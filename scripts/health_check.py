@@ -4,13 +4,42 @@ Health Check Monitor
 monitoring script for web services and registering results
 """
 
-import requests
+import argparse
+import atexit
+import hashlib
+import heapq
+import http.client
+import itertools
 import json
+import math
+import queue
+import random
+import signal
+import socket
+import ssl
+import string
+import threading
 import time
+from bisect import bisect
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urlsplit
 import sys
 import os
 
+# requests is only needed by the "requests" engine. Set
+# HEALTH_CHECK_STDLIB_ONLY=1 to skip importing it (faster start, less
+# memory) when every endpoint uses the "http" or "tcp" engines. asyncio,
+# sqlite3, multiprocessing and http.server are imported where they are used.
+requests = None
+if not os.environ.get("HEALTH_CHECK_STDLIB_ONLY"):
+    try:
+        import requests
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        requests = None
+
 # Configuration
 ENDPOINTS = [
     {
@@ -29,132 +58,3111 @@ ENDPOINTS = [
         "name": "Library API - Books",
         "url": "http://library-api:8000/api/books",
         "expected_status": 200,
-        "timeout": 5
+        "timeout": 5,
+        "conditional": True
     }
 ]
 
 LOG_FILE = "health_check.log"
 
+# Endpoint config files (--config)
+DEFAULT_EXPECTED_STATUS = 200
+DEFAULT_TIMEOUT = 5
+CONFIG_POLL_INTERVAL = 5  # seconds between config file change checks
+
+# Maximum number of checks in flight at once (1 = sequential, original behaviour)
+MAX_WORKERS = 1
+
+# Probe engine used when an endpoint does not set "engine":
+#   "requests"      - requests GET, reusing pooled connections in continuous mode
+#   "http"/"timed"  - stdlib GET on a fresh connection with a per-phase breakdown
+#   "tcp"           - stdlib connect check (plus TLS handshake for https/"tls")
+DEFAULT_ENGINE = "requests" if requests is not None else "http"
+TIMING_PHASES = ("dns_ms", "connect_ms", "tls_ms", "ttfb_ms", "body_ms")
+
+# Threaded monitor (--workers)
+PER_HOST = 10  # checks in flight to one host, as many as its pooled connections
+
+# Asyncio monitor (--async)
+ASYNC_CONCURRENCY = 1000  # checks in flight at once
+ASYNC_PER_HOST = 100  # checks in flight to one host
+
+# Process pool (--processes)
+PROCESS_THREADS = 20  # checks in flight in each worker process
+
+# Body assertions ("body_contains" / "max_body_bytes" on an endpoint)
+BODY_MAX_BYTES = 64 * 1024  # stop reading the body after this many bytes
+BODY_CHUNK_SIZE = 8 * 1024
+BODY_DRAIN_BYTES = 64 * 1024  # unread remainder drained to keep the connection
+
+# Keep-alive connection pool (continuous mode)
+POOL_SIZE = 10  # connections kept per host
+POOL_IDLE_TIMEOUT = 300  # seconds before an unused host pool is closed
+
+# DNS cache of the probes' new connections (--dns-ttl). getaddrinfo() does not
+# expose record TTLs, so addresses are reused for DNS_CACHE_TTL seconds
+DNS_CACHE_TTL = 0  # 0: no cache, every new connection resolves
+DNS_REFRESH_AHEAD = 0.8  # names in use are re-resolved after this fraction of the TTL
+
+# Rolling statistics
+STATS_WINDOW = 1000  # most recent checks kept per endpoint
+
+# Adaptive timeouts (--adaptive-timeout, or "adaptive_timeout" per endpoint)
+# The deadline becomes p99 latency x factor, between ADAPTIVE_TIMEOUT_MIN and
+# the endpoint's configured timeout
+ADAPTIVE_TIMEOUTS = False
+ADAPTIVE_TIMEOUT_FACTOR = 3.0
+ADAPTIVE_TIMEOUT_MIN = 0.25  # seconds
+ADAPTIVE_MIN_SAMPLES = 20  # responses needed before adapting
+ADAPTIVE_RELEARN_AFTER = 5  # adaptive timeouts in a row before one full-timeout check
+PERCENTILE_REFRESH = 10  # new samples before cached percentiles are recomputed
+
+# Latency anomaly detection (--anomaly-detection)
+# A fast EWMA of log latency is compared with a slow EWMA baseline and its
+# EWMV; an anomaly starts when the fast one drifts ANOMALY_THRESHOLD standard
+# errors above the baseline and ends when it falls back under half of that
+ANOMALY_DETECTION = False
+ANOMALY_FAST_ALPHA = 0.1
+ANOMALY_SLOW_ALPHA = 0.01
+ANOMALY_THRESHOLD = 3.5
+ANOMALY_ADAPT_FACTOR = 0.1  # the baseline learns this much slower during an anomaly
+ANOMALY_WARMUP = 30  # responses before anomalies are reported
+ANOMALY_MIN_STDDEV = 0.1  # in log(ms), ~10%: ignore jitter of very stable endpoints
+
+# Circuit breaker (--circuit-breaker, or "circuit_breaker" per endpoint)
+# After BREAKER_THRESHOLD failures in a row an endpoint is skipped, then
+# retried once (half-open) after a delay that doubles on every failed trial
+CIRCUIT_BREAKER = False
+BREAKER_THRESHOLD = 5
+BREAKER_BASE_DELAY = 60  # seconds
+BREAKER_MAX_DELAY = 3600  # seconds
+
+# Results store (--store)
+STORE_BATCH_SIZE = 500  # results buffered before writing to the store
+STORE_FLUSH_INTERVAL = 10  # seconds between store writes
+STORE_ROLLUP_INTERVAL = 60  # seconds between rollup/retention passes
+STORE_ROLLUPS = {"1m": 60, "5m": 300, "1h": 3600}  # resolution -> bucket seconds
+STORE_RETENTION = {  # resolution -> seconds of history kept
+    "raw": 2 * 86400,
+    "1m": 7 * 86400,
+    "5m": 30 * 86400,
+    "1h": 400 * 86400,
+}
+
+# Monitor state snapshots (--state)
+STATE_VERSION = 2
+STATE_SAVE_INTERVAL = 60  # seconds between snapshots in continuous mode
+STATE_SAMPLES = 100  # most recent checks saved per endpoint (latencies only, no timings)
+
+# Sharding (--shard INDEX/COUNT, or --ring IDS --monitor-id ID)
+SHARD_RING_REPLICAS = 100  # points per monitor on the consistent-hash ring
+
+# Prometheus metrics endpoint (--metrics-port)
+METRICS_HOST = "0.0.0.0"
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+
+# Buffered log writer (--buffered-log)
+LOG_QUEUE_SIZE = 10000  # lines waiting for the writer thread
+LOG_FLUSH_BYTES = 64 * 1024  # flush once this much is pending
+LOG_FLUSH_INTERVAL = 1.0  # seconds between flushes
+
+CONSOLE_OUTPUT = True
+
+_log_lock = threading.Lock()
+_log_writer = None
+
+class BufferedLogWriter:
+    """
+    Long-lived log file written by a background thread
+    Lines go through a bounded queue and are written in batches, flushed
+    when flush_bytes are pending, every flush_interval seconds and on close
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, path, queue_size=LOG_QUEUE_SIZE,
+                 flush_bytes=LOG_FLUSH_BYTES, flush_interval=LOG_FLUSH_INTERVAL):
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self._file = open(path, 'a')
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, line):
+        """Queue a line, blocks if the writer is queue_size lines behind"""
+        self._queue.put(line)
+
+    def _run(self):
+        pending = []
+        pending_bytes = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                line = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                line = None
+            
+            if line is self._CLOSE:
+                break
+            if line is not None:
+                pending.append(line)
+                pending_bytes += len(line)
+            
+            if pending_bytes >= self.flush_bytes or time.monotonic() >= deadline:
+                if pending:
+                    self._file.write(''.join(pending))
+                    self._file.flush()
+                    pending = []
+                    pending_bytes = 0
+                deadline = time.monotonic() + self.flush_interval
+        
+        self._file.write(''.join(pending))
+        self._file.close()
+
+    def close(self):
+        """Write everything still queued and close the file"""
+        if self._thread.is_alive():
+            self._queue.put(self._CLOSE)
+            self._thread.join()
+
+def configure_logging(buffered=False, console=True):
+    """
+    Choose how log_message writes
+    Args:
+        buffered: keep LOG_FILE open and write it from a background thread
+        console: also print each message to stdout
+    """
+    global _log_writer, CONSOLE_OUTPUT
+    with _log_lock:
+        if _log_writer is not None:
+            _log_writer.close()
+            _log_writer = None
+        if buffered:
+            _log_writer = BufferedLogWriter(LOG_FILE)
+            atexit.register(_log_writer.close)
+        CONSOLE_OUTPUT = console
+
+_log_capture = threading.local()  # .lines set: messages are collected instead of written
+
 def log_message(message, level="INFO"):
     """register log message to file and console"""
+    lines = getattr(_log_capture, 'lines', None)
+    if lines is not None:
+        lines.append((message, level))
+        return
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log_entry = f"[{timestamp}] [{level}] {message}"
-    print(log_entry)
-    with open(LOG_FILE, 'a') as f:
-        f.write(log_entry + '\n')
+    # checks may run in parallel threads, keep each line in one piece
+    with _log_lock:
+        if CONSOLE_OUTPUT:
+            print(log_entry)
+        if _log_writer is not None:
+            _log_writer.write(log_entry + '\n')
+        else:
+            with open(LOG_FILE, 'a') as f:
+                f.write(log_entry + '\n')
+
+def _parse_config(path, data):
+    """Decode a config file according to its extension"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.json':
+        return json.loads(data)
+    if ext in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("PyYAML is required for YAML config files (pip install pyyaml)")
+        return yaml.safe_load(data)
+    if ext == '.toml':
+        import tomllib
+        return tomllib.loads(data.decode('utf-8'))
+    raise ValueError(f"Unsupported config file type: {path}")
+
+def load_endpoints(path):
+    """
+    Load endpoint definitions from a JSON, YAML or TOML file
+    The file holds a list of endpoints or a mapping with an "endpoints" list.
+    Each endpoint needs "name" and "url"; "expected_status" and "timeout"
+    default to 200 and 5s, "interval", "jitter" and "headers" are optional.
+    Endpoints with "engine": "transaction" also need "steps".
+    Returns: list of endpoint dictionaries
+    """
+    with open(path, 'rb') as f:
+        config = _parse_config(path, f.read())
+    
+    if isinstance(config, dict):
+        config = config.get('endpoints')
+    if not isinstance(config, list):
+        raise ValueError(f"{path}: expected a list of endpoints")
+    
+    endpoints = []
+    names = set()
+    for item in config:
+        if not isinstance(item, dict) or 'name' not in item or 'url' not in item:
+            raise ValueError(f"{path}: every endpoint needs a name and a url")
+        if item['name'] in names:
+            raise ValueError(f"{path}: duplicate endpoint name {item['name']!r}")
+        if item.get('engine') == "transaction" and not item.get('steps'):
+            raise ValueError(f"{path}: transaction {item['name']!r} needs a list of steps")
+        names.add(item['name'])
+        endpoint = dict(item)
+        endpoint.setdefault('expected_status', DEFAULT_EXPECTED_STATUS)
+        endpoint.setdefault('timeout', DEFAULT_TIMEOUT)
+        endpoints.append(endpoint)
+    return endpoints
+
+class EndpointConfigWatcher:
+    """
+    Endpoint config file reloaded when it changes on disk
+    With a shard, only the endpoints it owns are kept
+    poll() reports which endpoints were added, removed or changed, so the
+    monitor only touches those and keeps its state for the rest
+    """
+
+    def __init__(self, path, shard=None):
+        self.path = path
+        self.shard = shard
+        self._signature = self._stat()
+        self.endpoints = self._load()
+
+    def _load(self):
+        endpoints = load_endpoints(self.path)
+        if self.shard is not None:
+            endpoints = self.shard.select(endpoints)
+        return {e['name']: e for e in endpoints}
+
+    def _stat(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def poll(self):
+        """
+        Reload the file if it changed
+        Returns: (added, removed, changed) endpoint lists, all empty when
+        the file is unchanged or cannot be loaded
+        """
+        try:
+            signature = self._stat()
+            if signature == self._signature:
+                return [], [], []
+            self._signature = signature
+            new = self._load()
+        except (OSError, ValueError) as e:
+            log_message(f"Config reload failed, keeping current endpoints: {e}", "ERROR")
+            return [], [], []
+        
+        old = self.endpoints
+        added = [e for name, e in new.items() if name not in old]
+        removed = [e for name, e in old.items() if name not in new]
+        changed = [e for name, e in new.items() if name in old and old[name] != e]
+        self.endpoints = new
+        return added, removed, changed
+
+if requests is not None:
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+
+    class _CachedDnsConnection:
+        """urllib3 connection resolving its host through the DNS cache when it is on"""
+
+        def _new_conn(self):
+            cache = get_dns_cache()
+            if cache is None:
+                return super()._new_conn()
+            dns_host = self._dns_host
+            addresses = cache.resolve(dns_host, self.port)
+            try:
+                for _, _, _, _, address in addresses:
+                    self._dns_host = address[0]
+                    try:
+                        return super()._new_conn()
+                    except (NewConnectionError, ConnectTimeoutError):
+                        if address == addresses[-1][4]:
+                            raise
+            finally:
+                self._dns_host = dns_host
+
+    class _CachedDnsHTTPConnection(_CachedDnsConnection, HTTPConnection):
+        pass
+
+    class _CachedDnsHTTPSConnection(_CachedDnsConnection, HTTPSConnection):
+        pass
+
+    class _CachedDnsHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = _CachedDnsHTTPConnection
+
+    class _CachedDnsHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = _CachedDnsHTTPSConnection
+
+    class CachedDnsAdapter(HTTPAdapter):
+        """HTTPAdapter whose new connections resolve through the DNS cache (--dns-ttl)"""
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": _CachedDnsHTTPConnectionPool,
+                "https": _CachedDnsHTTPSConnectionPool,
+            }
+
+def make_session(pool_size=POOL_SIZE):
+    """requests session keeping up to pool_size connections per host, resolving through the DNS cache"""
+    session = requests.Session()
+    adapter = CachedDnsAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class SessionPool:
+    """
+    Keep-alive HTTP sessions shared across monitoring cycles
+    One session (and connection pool) per host, closed after being idle
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._sessions = {}  # "scheme://host:port" -> [session, last_used]
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """Return the session for the host of url, creating it if needed"""
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                entry = [make_session(self.pool_size), now]
+                self._sessions[key] = entry
+            entry[1] = now
+            return entry[0]
+
+    def evict_idle(self):
+        """
+        Close sessions not used for idle_timeout seconds
+        Returns: number of sessions closed
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                key for key, (_, last_used) in self._sessions.items()
+                if now - last_used >= self.idle_timeout
+            ]
+            for key in idle:
+                self._sessions.pop(key)[0].close()
+        return len(idle)
+
+    def close(self):
+        """Close all sessions"""
+        with self._lock:
+            for session, _ in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
+
+class ProbeTimeout(Exception):
+    """A stdlib probe ran out of time"""
+
+class ProbeConnectionError(Exception):
+    """A stdlib probe could not resolve, connect or negotiate TLS"""
+
+class BodyScanner:
+    """
+    Incremental search for a marker in a response body
+    feed() chunks until it returns True: the marker was found, even across
+    chunk boundaries, or max_bytes have been read
+    """
+
+    def __init__(self, marker, max_bytes=BODY_MAX_BYTES):
+        self.needle = marker.encode('utf-8')
+        self.max_bytes = max_bytes
+        self.found = False
+        self.read = 0
+        self._tail = b''
+
+    def feed(self, chunk):
+        chunk = chunk[:self.max_bytes - self.read]
+        self.read += len(chunk)
+        window = self._tail + chunk
+        if self.needle in window:
+            self.found = True
+            return True
+        keep = len(self.needle) - 1
+        self._tail = window[-keep:] if keep else b''
+        return self.read >= self.max_bytes
+
+def scan_body(chunks, marker, max_bytes=BODY_MAX_BYTES):
+    """
+    Look for marker in a stream of body chunks, reading at most max_bytes
+    Stops as soon as the marker is found, even across chunk boundaries
+    Returns: (found, bytes_read)
+    """
+    scanner = BodyScanner(marker, max_bytes)
+    for chunk in chunks:
+        if scanner.feed(chunk):
+            break
+    return scanner.found, scanner.read
+
+def _release_response(response):
+    """
+    Hand a partially read streamed response back to the pool
+    A short remainder is drained so the keep-alive connection is reused;
+    a long one is closed rather than downloaded
+    """
+    remaining = None
+    length = response.headers.get('Content-Length')
+    if length is not None and length.isdigit():
+        remaining = int(length) - response.raw.tell()
+    if remaining is not None and remaining <= BODY_DRAIN_BYTES:
+        for _ in response.iter_content(BODY_CHUNK_SIZE):
+            pass
+    response.close()
+
+# Last ETag / Last-Modified of each "conditional" endpoint, by endpoint name
+VALIDATORS = {}
+
+def probe_method(endpoint):
+    """HTTP method of a probe, GET (default) or HEAD"""
+    return endpoint.get('method', 'GET').upper()
+
+def request_headers(endpoint):
+    """
+    Headers of a probe: the endpoint's own, plus If-None-Match and
+    If-Modified-Since from its last response when it is "conditional"
+    """
+    headers = dict(endpoint.get('headers') or {})
+    if endpoint.get('conditional'):
+        validators = endpoint.get('validators') or VALIDATORS.get(endpoint['name'], {})
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+def server_cpu_ms(server_timing):
+    """CPU time (ms) of the "cpu" metric of a Server-Timing header, or None"""
+    if not server_timing:
+        return None
+    for metric in server_timing.split(','):
+        name, *params = metric.split(';')
+        if name.strip() == 'cpu':
+            for param in params:
+                key, _, value = param.strip().partition('=')
+                if key == 'dur':
+                    try:
+                        return float(value)
+                    except ValueError:
+                        return None
+    return None
+
+def response_details(endpoint, status_code, headers, body_bytes, sent_headers):
+    """
+    Outcome fields shared by the HTTP engines: body size, server CPU time
+    (from Server-Timing), whether a conditional GET got a 304 and the
+    validators to send next time
+    """
+    details = {"body_bytes": body_bytes}
+    cpu = server_cpu_ms(headers.get('server-timing'))
+    if cpu is not None:
+        details['server_cpu_ms'] = cpu
+    if endpoint.get('conditional'):
+        if status_code == 304 and ('If-None-Match' in sent_headers
+                                   or 'If-Modified-Since' in sent_headers):
+            details['not_modified'] = True
+        if headers.get('etag'):
+            details['etag'] = headers.get('etag')
+        if headers.get('last-modified'):
+            details['last_modified'] = headers.get('last-modified')
+    return details
+
+def _probe_requests(endpoint, session=None):
+    """
+    GET (or HEAD) the endpoint with requests (default engine)
+    The body is streamed: body_bytes counts it as sent on the wire (still
+    compressed), like the stdlib engines. With "body_contains", it is only
+    read until the marker shows up or "max_body_bytes" have been read
+    Returns: dictionary with status_code, response_time_ms and body_bytes
+    (plus body_match and body_bytes_read for body assertions)
+    """
+    if requests is None:
+        raise RuntimeError("requests is not installed, use the http or tcp engine")
+    own_session = None
+    if session is None and get_dns_cache() is not None:
+        session = own_session = make_session(1)  # what requests.get does, through the cache
+    client = session if session is not None else requests
+    method = probe_method(endpoint)
+    fetch = client.head if method == "HEAD" else client.get
+    kwargs = {"timeout": endpoint['timeout'], "stream": True}
+    headers = request_headers(endpoint)
+    if headers:
+        kwargs['headers'] = headers
+    marker = endpoint.get('body_contains') if method != "HEAD" else None
+    
+    start_time = time.perf_counter()
+    try:
+        response = fetch(endpoint['url'], **kwargs)
+    finally:
+        if own_session is not None:
+            own_session.close()  # the response keeps its connection
+    outcome = {"status_code": response.status_code}
+    if marker:
+        body_bytes = 0
+        try:
+            if response.status_code != 304:
+                found, body_bytes = scan_body(
+                    response.iter_content(BODY_CHUNK_SIZE), marker,
+                    endpoint.get('max_body_bytes', BODY_MAX_BYTES)
+                )
+                outcome['body_match'] = found
+                outcome['body_bytes_read'] = body_bytes
+        finally:
+            _release_response(response)
+    else:
+        try:
+            body_bytes = sum(len(chunk) for chunk in
+                             response.raw.stream(BODY_CHUNK_SIZE, decode_content=False))
+        finally:
+            response.raw.release_conn()
+    outcome['response_time_ms'] = round((time.perf_counter() - start_time) * 1000, 2)  # ms
+    outcome.update(response_details(endpoint, response.status_code, response.headers,
+                                    body_bytes, headers))
+    return outcome
+
+def _target(endpoint):
+    """
+    Where a stdlib probe connects
+    Returns: (host, port, tls, path) from an http://, https:// or tcp:// url
+    """
+    parts = urlsplit(endpoint['url'])
+    tls = endpoint.get('tls', parts.scheme == 'https')
+    port = parts.port or {"http": 80, "https": 443}.get(parts.scheme)
+    if port is None:
+        raise ValueError(f"No port in {endpoint['url']}")
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return parts.hostname, port, tls, path
+
+class DnsCache:
+    """
+    getaddrinfo() results reused for ttl seconds
+    A name is in use when it was looked up since it was last resolved. A
+    background thread re-resolves names in use once refresh_ahead of their
+    TTL has passed, so their probes keep hitting the cache; names nobody
+    looks up expire. When a refresh fails the old addresses are kept until
+    they expire.
+    """
+
+    def __init__(self, ttl, refresh_ahead=DNS_REFRESH_AHEAD, resolver=socket.getaddrinfo,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.resolver = resolver
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._entries = {}  # (host, port) -> [addresses, resolved_at, in_use]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _cached(self, key):
+        """Unexpired addresses of key (marking it in use), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[1] < self.ttl:
+                entry[2] = True
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def _store(self, key, addresses, in_use=True):
+        with self._lock:
+            self._entries[key] = [addresses, self.clock(), in_use]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+                self._thread.start()
+
+    def resolve(self, host, port):
+        """getaddrinfo(host, port) for a stream socket, from the cache when possible"""
+        addresses = self._cached((host, port))
+        if addresses is None:
+            addresses = self.resolver(host, port, type=socket.SOCK_STREAM)
+            self._store((host, port), addresses)
+        return addresses
+
+    async def resolve_async(self, host, port):
+        """resolve() for the event loop: a cache miss does not block it"""
+        import asyncio
+        addresses = self._cached((host, port))
+        if addresses is None:
+            addresses = await asyncio.get_running_loop().getaddrinfo(
+                host, port, type=socket.SOCK_STREAM
+            )
+            self._store((host, port), addresses)
+        return addresses
+
+    def refresh(self):
+        """
+        Re-resolve the names in use past refresh_ahead of their TTL and drop
+        expired names nobody looked up
+        Returns: number of names re-resolved
+        """
+        now = self.clock()
+        with self._lock:
+            due = [key for key, (_, resolved_at, in_use) in self._entries.items()
+                   if in_use and now - resolved_at >= self.ttl * self.refresh_ahead]
+            for key, (_, resolved_at, in_use) in list(self._entries.items()):
+                if not in_use and now - resolved_at >= self.ttl:
+                    del self._entries[key]
+        
+        refreshed = 0
+        for host, port in due:
+            try:
+                addresses = self.resolver(host, port, type=socket.SOCK_STREAM)
+            except OSError as e:
+                log_message(f"DNS refresh of {host} failed, keeping cached addresses: {e}", "WARNING")
+                continue
+            self._store((host, port), addresses, in_use=False)
+            refreshed += 1
+        self.refreshes += refreshed
+        return refreshed
+
+    def _refresh_loop(self):
+        period = max(1, self.ttl * (1 - self.refresh_ahead) / 2)
+        while not self._stop.wait(period):
+            self.refresh()
 
-def check_endpoint(endpoint):
+    def close(self):
+        """Stop the background refresh"""
+        self._stop.set()
+
+    def __len__(self):
+        return len(self._entries)
+
+# Shared DNS cache, created on first use when DNS_CACHE_TTL is set
+DNS_CACHE = None
+_dns_lock = threading.Lock()
+
+def get_dns_cache():
+    """Return the DnsCache, None when DNS caching is off"""
+    global DNS_CACHE
+    if not DNS_CACHE_TTL:
+        return None
+    with _dns_lock:
+        if DNS_CACHE is None:
+            DNS_CACHE = DnsCache(DNS_CACHE_TTL)
+        return DNS_CACHE
+
+def resolve(host, port):
+    """Addresses to connect a probe to, through the DNS cache when it is on"""
+    cache = get_dns_cache()
+    if cache is None:
+        return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return cache.resolve(host, port)
+
+async def resolve_async(host, port):
+    """resolve() for the event loop"""
+    import asyncio
+    cache = get_dns_cache()
+    if cache is None:
+        return await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return await cache.resolve_async(host, port)
+
+# Shared TLS client context, created on first use (creating one loads the CA bundle)
+TLS_CONTEXT = None
+_tls_lock = threading.Lock()
+
+def get_tls_context():
+    """Return the default SSLContext shared by the stdlib and async probes"""
+    global TLS_CONTEXT
+    with _tls_lock:
+        if TLS_CONTEXT is None:
+            TLS_CONTEXT = ssl.create_default_context()
+        return TLS_CONTEXT
+
+def _open_socket(host, port, timeout, tls, marks):
+    """
+    Resolve (through the DNS cache when it is on), connect and optionally
+    negotiate TLS, appending the monotonic time after each of those three
+    phases to marks
+    Returns: connected socket
+    """
+    addresses = resolve(host, port)
+    marks.append(time.perf_counter())
+    
+    for family, socktype, proto, _, address in addresses:
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+            break
+        except OSError:
+            sock.close()
+            if address == addresses[-1][4]:
+                raise
+    marks.append(time.perf_counter())
+    
+    if tls:
+        try:
+            sock = get_tls_context().wrap_socket(sock, server_hostname=host)
+        except OSError:
+            sock.close()
+            raise
+    marks.append(time.perf_counter())
+    return sock
+
+def _phase_timings(marks):
+    """Per-phase durations (ms) from consecutive marks"""
+    phases = [round((b - a) * 1000, 2) for a, b in zip(marks, marks[1:])]
+    return dict(zip(TIMING_PHASES, phases))
+
+def _probe_http(endpoint, session=None):
+    """
+    GET (or HEAD) the endpoint on a fresh stdlib connection, timing each phase
+    DNS resolution, TCP connect, TLS handshake, time to first byte (status
+    line and headers) and body transfer are measured on the monotonic clock
+    Returns: dictionary with status_code, response_time_ms and timings (ms)
+    """
+    host, port, tls, path = _target(endpoint)
+    timeout = endpoint['timeout']
+    method = probe_method(endpoint)
+    headers = request_headers(endpoint)
+    marker = endpoint.get('body_contains') if method != "HEAD" else None
+    
+    sock = None
+    marks = [time.perf_counter()]
+    try:
+        sock = _open_socket(host, port, timeout, tls, marks)
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        conn.sock = sock
+        conn.request(method, path, headers=headers)
+        response = conn.getresponse()
+        marks.append(time.perf_counter())
+        if marker and response.status != 304:
+            found, body_bytes = scan_body(
+                iter(lambda: response.read(BODY_CHUNK_SIZE), b''), marker,
+                endpoint.get('max_body_bytes', BODY_MAX_BYTES)
+            )
+        else:
+            marker = None
+            body_bytes = len(response.read())
+        marks.append(time.perf_counter())
+    except TimeoutError:
+        raise ProbeTimeout()
+    except OSError as e:
+        raise ProbeConnectionError(str(e))
+    finally:
+        if sock is not None:
+            sock.close()
+    
+    outcome = {
+        "status_code": response.status,
+        "response_time_ms": round((marks[-1] - marks[0]) * 1000, 2),
+        "timings": _phase_timings(marks),
+    }
+    if marker:
+        outcome['body_match'] = found
+        outcome['body_bytes_read'] = body_bytes
+    outcome.update(response_details(endpoint, response.status, response.headers,
+                                    body_bytes, headers))
+    return outcome
+
+def _probe_tcp(endpoint, session=None):
+    """
+    Connect check: resolve, TCP connect and, for https:// urls or
+    "tls": true, the TLS handshake. No request is sent.
+    Returns: dictionary with status_code None, response_time_ms and timings
+    """
+    host, port, tls, _ = _target(endpoint)
+    marks = [time.perf_counter()]
+    try:
+        _open_socket(host, port, endpoint['timeout'], tls, marks).close()
+    except TimeoutError:
+        raise ProbeTimeout()
+    except OSError as e:
+        raise ProbeConnectionError(str(e))
+    return {
+        "status_code": None,
+        "response_time_ms": round((marks[-1] - marks[0]) * 1000, 2),
+        "timings": _phase_timings(marks),
+    }
+
+def _substitute(value, variables):
+    """Replace ${name} placeholders in a string, or in the strings of a list or dict"""
+    if isinstance(value, str):
+        try:
+            return string.Template(value).substitute(variables)
+        except KeyError as e:
+            raise ValueError(f"Undefined variable {e.args[0]!r}")
+    if isinstance(value, list):
+        return [_substitute(item, variables) for item in value]
+    if isinstance(value, dict):
+        return {key: _substitute(item, variables) for key, item in value.items()}
+    return value
+
+def _capture(data, path):
+    """Value at a dotted path ("id", "items.0.id") of a decoded JSON document"""
+    for key in path.split('.'):
+        if isinstance(data, list) and key.isdigit() and int(key) < len(data):
+            data = data[int(key)]
+        elif isinstance(data, dict) and key in data:
+            data = data[key]
+        else:
+            raise KeyError(path)
+    return data
+
+def _probe_transaction(endpoint, session=None):
+    """
+    Run the endpoint's "steps" in order on one keep-alive stdlib connection
+    Each step has a "path" relative to the endpoint url and optionally a
+    "method" (GET), "headers", a "json" or "body" payload, an
+    "expected_status" (200) and "capture", mapping variable names to dotted
+    paths in its JSON response. Captured values (and the endpoint's
+    "variables") replace ${name} in the steps that follow. The transaction
+    stops at the first step with an unexpected status. A server that closes
+    the connection (no keep-alive, e.g. the Flask development server) makes
+    the next step reconnect.
+    Returns: dictionary with status_code and expected_status of the last step
+    run, response_time_ms of the whole transaction, the status and time of
+    each step in "steps" and the number of connections opened
+    """
+    host, port, tls, base_path = _target(endpoint)
+    base_path = base_path.rstrip('/')
+    timeout = endpoint['timeout']
+    variables = dict(endpoint.get('variables') or {})
+    
+    conn = None
+    connections = 0
+    steps = []
+    start_time = time.perf_counter()
+    try:
+        for number, step in enumerate(endpoint['steps'], 1):
+            method = step.get('method', 'GET').upper()
+            path = base_path + _substitute(step.get('path', ''), variables)
+            headers = dict(endpoint.get('headers') or {})
+            headers.update(_substitute(step.get('headers') or {}, variables))
+            body = None
+            if 'json' in step:
+                body = json.dumps(_substitute(step['json'], variables)).encode('utf-8')
+                headers.setdefault('Content-Type', 'application/json')
+            elif 'body' in step:
+                body = _substitute(step['body'], variables).encode('utf-8')
+            
+            step_start = time.perf_counter()
+            if conn is None or conn.sock is None:
+                # First step, or the server closed the previous connection
+                conn = http.client.HTTPConnection(host, port, timeout=timeout)
+                conn.sock = _open_socket(host, port, timeout, tls, [])
+                connections += 1
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            expected = step.get('expected_status', DEFAULT_EXPECTED_STATUS)
+            steps.append({
+                "step": step.get('name', f"{method} {path}"),
+                "status_code": response.status,
+                "response_time_ms": round((time.perf_counter() - step_start) * 1000, 2),
+            })
+            if response.status != expected:
+                break
+            for name, field in (step.get('capture') or {}).items():
+                try:
+                    variables[name] = _capture(json.loads(data), field)
+                except (ValueError, KeyError):
+                    raise ValueError(f"Step {number}: no {field!r} in response")
+    except TimeoutError:
+        raise ProbeTimeout()
+    except (OSError, http.client.HTTPException) as e:
+        raise ProbeConnectionError(str(e))
+    finally:
+        if conn is not None:
+            conn.close()
+    
+    return {
+        "status_code": response.status,
+        "expected_status": expected,
+        "response_time_ms": round((time.perf_counter() - start_time) * 1000, 2),
+        "steps": steps,
+        "connections": connections,
+    }
+
+# Probe engines, selected per endpoint with "engine" (default: DEFAULT_ENGINE)
+PROBE_ENGINES = {
+    "requests": _probe_requests,
+    "http": _probe_http,
+    "timed": _probe_http,
+    "tcp": _probe_tcp,
+    "transaction": _probe_transaction,
+}
+
+TIMEOUT_ERRORS = (ProbeTimeout,)  # async_check_endpoint maps asyncio.TimeoutError to it
+CONNECTION_ERRORS = (ProbeConnectionError,)
+if requests is not None:
+    TIMEOUT_ERRORS += (requests.exceptions.Timeout,)
+    CONNECTION_ERRORS += (requests.exceptions.ConnectionError,)
+
+def apply_timeout(endpoint):
+    """
+    Endpoint with the timeout its next check should use
+    Returns: (endpoint, adaptive timeout or None when the configured one applies)
+    """
+    timeout = effective_timeout(endpoint)
+    if timeout == endpoint['timeout']:
+        return endpoint, None
+    return dict(endpoint, timeout=timeout), timeout
+
+def check_endpoint(endpoint, session=None):
     """
     Check availability of an endpoint
+    Args:
+        endpoint: endpoint definition
+        session: requests.Session to reuse connections (optional)
     Returns: dictionary with check result
     """
+    endpoint, adaptive_timeout = apply_timeout(endpoint)
     try:
-        start_time = time.time()
-        response = requests.get(
-            endpoint['url'], 
-            timeout=endpoint['timeout']
+        probe = PROBE_ENGINES[endpoint.get('engine', DEFAULT_ENGINE)]
+        result = build_result(endpoint, probe(endpoint, session))
+    except Exception as e:
+        result = error_result(endpoint, e)
+    if adaptive_timeout is not None:
+        result['adaptive_timeout'] = adaptive_timeout
+    return result
+
+def build_result(endpoint, outcome):
+    """Result of a probe that got an answer, logged as a ✓ or ✗ line"""
+    status_code = outcome.pop('status_code')
+    response_time = outcome.pop('response_time_ms')
+    # transactions report the expectation of the step they stopped at
+    expected_status = outcome.pop('expected_status', endpoint['expected_status'])
+    
+    # tcp checks have no status code, connecting is the check
+    # a 304 to a conditional GET means the resource is there and unchanged
+    status_ok = (status_code is None or status_code == expected_status
+                 or outcome.get('not_modified', False))
+    body_ok = outcome.get('body_match', True)
+    
+    result = {
+        "name": endpoint['name'],
+        "url": endpoint['url'],
+        "status_code": status_code,
+        "expected_status": expected_status,
+        "response_time_ms": response_time,
+        "success": status_ok and body_ok,
+        "timestamp": datetime.now().isoformat()
+    }
+    result.update(outcome)
+    
+    if status_ok and body_ok:
+        log_message(
+            f"✓ {endpoint['name']} - Status: {status_code or 'open'} - "
+            f"Response time: {response_time}ms",
+            "INFO"
         )
-        response_time = round((time.time() - start_time) * 1000, 2)  # ms
-        
-        status_ok = response.status_code == endpoint['expected_status']
-        
-        result = {
-            "name": endpoint['name'],
-            "url": endpoint['url'],
-            "status_code": response.status_code,
-            "expected_status": endpoint['expected_status'],
-            "response_time_ms": response_time,
-            "success": status_ok,
-            "timestamp": datetime.now().isoformat()
+    elif not status_ok:
+        log_message(
+            f"✗ {endpoint['name']} - Expected {expected_status}, "
+            f"got {status_code}",
+            "WARNING"
+        )
+    else:
+        result['error'] = "Body mismatch"
+        log_message(
+            f"✗ {endpoint['name']} - Body mismatch: {endpoint['body_contains']!r} "
+            f"not found in first {outcome['body_bytes_read']} bytes",
+            "WARNING"
+        )
+    
+    return result
+
+def error_result(endpoint, exc):
+    """Result of a probe that raised, logged as an ✗ line"""
+    if isinstance(exc, TIMEOUT_ERRORS):
+        log_message(f"✗ {endpoint['name']} - Timeout after {endpoint['timeout']}s", "ERROR")
+        error = "Timeout"
+    elif isinstance(exc, CONNECTION_ERRORS):
+        log_message(f"✗ {endpoint['name']} - Connection refused", "ERROR")
+        error = "Connection refused"
+    else:
+        log_message(f"✗ {endpoint['name']} - Error: {str(exc)}", "ERROR")
+        error = str(exc)
+    return {
+        "name": endpoint['name'],
+        "url": endpoint['url'],
+        "success": False,
+        "error": error,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+class LatencyStats:
+    """
+    Rolling statistics of one endpoint over its most recent checks
+    Samples live in a ring buffer of `window` entries, so memory stays
+    constant however long the monitor runs
+    """
+
+    def __init__(self, window=STATS_WINDOW):
+        # (success, response_time_ms or None, timings dict or None)
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._added = 0
+        self._sorted = None  # (added when sorted, sorted latencies)
+
+    def add(self, success, response_time_ms=None, timings=None):
+        with self._lock:
+            self._samples.append((success, response_time_ms, timings))
+            self._added += 1
+
+    def latency_percentile(self, pct):
+        """
+        Percentile of the latencies in the window, cheap enough to call per check
+        The sorted latencies are reused until PERCENTILE_REFRESH samples arrive
+        Returns: (latency in ms or None, number of latencies)
+        """
+        with self._lock:
+            if self._sorted is None or self._added - self._sorted[0] >= PERCENTILE_REFRESH:
+                latencies = sorted(ms for _, ms, _ in self._samples if ms is not None)
+                self._sorted = (self._added, latencies)
+            latencies = self._sorted[1]
+        return percentile(latencies, pct), len(latencies)
+
+    def to_state(self, last=STATE_SAMPLES):
+        """
+        The last `last` samples, without phase timings: enough for adaptive
+        timeouts and success ratios after a restart
+        Returns: {"ok": "1101...", "ms": [latency or None, ...]}
+        """
+        with self._lock:
+            samples = list(itertools.islice(reversed(self._samples), last))[::-1]
+        return {
+            "ok": "".join("1" if ok else "0" for ok, _, _ in samples),
+            "ms": [ms for _, ms, _ in samples],
         }
+
+    @classmethod
+    def from_state(cls, state, window=STATS_WINDOW):
+        """LatencyStats holding the samples of a to_state() dictionary"""
+        stats = cls(window)
+        for ok, ms in zip(state['ok'], state['ms']):
+            stats.add(ok == "1", ms)
+        return stats
+
+    def summary(self, last=None):
+        """
+        Statistics over the window, or over the last `last` checks
+        Returns: dictionary with checks, success_ratio, min, max, p50, p95, p99
+        (latencies in ms, None when no check got a response) and "phases",
+        the p50/p95/p99 of each timing phase recorded by the timed engine
+        """
+        with self._lock:
+            samples = list(self._samples)
+        if last is not None:
+            samples = samples[-last:]
         
-        if status_ok:
-            log_message(
-                f"✓ {endpoint['name']} - Status: {response.status_code} - "
-                f"Response time: {response_time}ms",
-                "INFO"
-            )
+        latencies = sorted(ms for _, ms, _ in samples if ms is not None)
+        checks = len(samples)
+        summary = {
+            "checks": checks,
+            "success_ratio": sum(1 for ok, _, _ in samples if ok) / checks if checks else None,
+            "min": latencies[0] if latencies else None,
+            "max": latencies[-1] if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "phases": {},
+        }
+        for phase in TIMING_PHASES:
+            values = sorted(t[phase] for _, _, t in samples if t and phase in t)
+            if values:
+                summary["phases"][phase] = {
+                    "p50": percentile(values, 50),
+                    "p95": percentile(values, 95),
+                    "p99": percentile(values, 99),
+                }
+        return summary
+
+# Per-endpoint rolling statistics, by endpoint name
+LATENCY_STATS = {}
+_stats_lock = threading.Lock()
+
+def get_stats(name):
+    """Return the LatencyStats of an endpoint, creating it if needed"""
+    with _stats_lock:
+        stats = LATENCY_STATS.get(name)
+        if stats is None:
+            stats = LATENCY_STATS[name] = LatencyStats()
+        return stats
+
+# Latest result of each endpoint (status fields only), by endpoint name
+LAST_RESULTS = {}
+LAST_RESULT_FIELDS = ("name", "url", "success", "status_code", "response_time_ms",
+                      "error", "timestamp")
+
+# Callbacks run with every check result, from the thread that made the check
+RESULT_LISTENERS = []
+
+# Callbacks run with every anomaly event (dictionaries with an "event" key)
+EVENT_LISTENERS = []
+
+# Callbacks run with the name of every endpoint dropped from monitoring (config
+# reload, including endpoints the shard no longer owns)
+REMOVAL_LISTENERS = []
+
+# Adaptive timeouts in a row, by endpoint name
+_timeout_streaks = {}
+
+def effective_timeout(endpoint):
+    """
+    Timeout (seconds) for the next check of an endpoint
+    With adaptive timeouts this is the endpoint's p99 latency times
+    ADAPTIVE_TIMEOUT_FACTOR, clamped between ADAPTIVE_TIMEOUT_MIN and the
+    configured timeout. The configured timeout is used until enough samples
+    exist, and once after every ADAPTIVE_RELEARN_AFTER adaptive timeouts in
+    a row so an endpoint that became slower can be learned again.
+    """
+    configured = endpoint['timeout']
+    if not endpoint.get('adaptive_timeout', ADAPTIVE_TIMEOUTS):
+        return configured
+    
+    name = endpoint['name']
+    with _stats_lock:
+        if _timeout_streaks.get(name, 0) >= ADAPTIVE_RELEARN_AFTER:
+            _timeout_streaks[name] = 0
+            return configured
+    
+    p99, samples = get_stats(name).latency_percentile(99)
+    if samples < ADAPTIVE_MIN_SAMPLES:
+        return configured
+    factor = endpoint.get('adaptive_factor', ADAPTIVE_TIMEOUT_FACTOR)
+    return round(min(configured, max(ADAPTIVE_TIMEOUT_MIN, p99 / 1000 * factor)), 3)
+
+def record_result(result):
+    """Feed a check result into the endpoint statistics and listeners"""
+    get_stats(result['name']).add(
+        result.get('success', False), result.get('response_time_ms'), result.get('timings')
+    )
+    last = {key: result.get(key) for key in LAST_RESULT_FIELDS}
+    with _stats_lock:
+        LAST_RESULTS[result['name']] = last
+    if 'adaptive_timeout' in result:
+        with _stats_lock:
+            if result.get('error') == "Timeout":
+                _timeout_streaks[result['name']] = _timeout_streaks.get(result['name'], 0) + 1
+            else:
+                _timeout_streaks.pop(result['name'], None)
+    if 'etag' in result or 'last_modified' in result:
+        with _stats_lock:
+            validators = VALIDATORS.setdefault(result['name'], {})
+            for key in ('etag', 'last_modified'):
+                if key in result:
+                    validators[key] = result[key]
+    if ANOMALY_DETECTION and result.get('response_time_ms') is not None:
+        event = get_detector(result['name']).update(result['response_time_ms'])
+        if event is not None:
+            emit_anomaly(event, result)
+    for listener in RESULT_LISTENERS:
+        listener(result)
+
+class AnomalyDetector:
+    """
+    Online latency anomaly detector for one endpoint, O(1) state
+    Keeps a slow EWMA (baseline) and EWMV of log latency and a fast EWMA of
+    recent latency. The fast average is scored in standard errors of an
+    EWMA above the baseline, so both a sudden jump and an endpoint taking a
+    slow path more often than usual are caught. The baseline keeps learning,
+    more slowly during an anomaly, so a lasting change eventually becomes
+    the new normal.
+    """
+
+    def __init__(self, fast_alpha=ANOMALY_FAST_ALPHA, slow_alpha=ANOMALY_SLOW_ALPHA,
+                 threshold=ANOMALY_THRESHOLD, warmup=ANOMALY_WARMUP):
+        self.fast_alpha = fast_alpha
+        self.slow_alpha = slow_alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self._error_scale = math.sqrt(fast_alpha / (2 - fast_alpha))
+        self.samples = 0
+        self.baseline = 0.0  # EWMA of log(ms)
+        self.variance = 0.0  # EWMV of log(ms)
+        self.recent = 0.0  # fast EWMA of log(ms)
+        self.anomalous = False
+        self.score = 0.0
+
+    def update(self, ms):
+        """
+        Add a response time
+        Returns: "anomaly" when an anomaly starts, "recovered" when it ends,
+        otherwise None
+        """
+        x = math.log(max(ms, 0.01))
+        if self.samples == 0:
+            self.baseline = self.recent = x
         else:
-            log_message(
-                f"✗ {endpoint['name']} - Expected {endpoint['expected_status']}, "
-                f"got {response.status_code}",
-                "WARNING"
+            self.recent += self.fast_alpha * (x - self.recent)
+            stddev = max(math.sqrt(self.variance), ANOMALY_MIN_STDDEV)
+            self.score = (self.recent - self.baseline) / (stddev * self._error_scale)
+            # Plain running mean and variance at first, so the baseline is
+            # not biased towards the first samples
+            alpha = max(self.slow_alpha, 1 / (self.samples + 1))
+            if self.anomalous:
+                alpha *= ANOMALY_ADAPT_FACTOR
+            diff = x - self.baseline
+            self.baseline += alpha * diff
+            self.variance = (1 - alpha) * (self.variance + alpha * diff * diff)
+        self.samples += 1
+        
+        if self.samples < self.warmup:
+            return None
+        if not self.anomalous and self.score > self.threshold:
+            self.anomalous = True
+            return "anomaly"
+        if self.anomalous and self.score < self.threshold / 2:
+            self.anomalous = False
+            return "recovered"
+        return None
+
+    _state_fields = ("samples", "baseline", "variance", "recent", "anomalous", "score")
+
+    def to_state(self):
+        return {field: getattr(self, field) for field in self._state_fields}
+
+    @classmethod
+    def from_state(cls, state):
+        detector = cls()
+        for field in cls._state_fields:
+            setattr(detector, field, state[field])
+        return detector
+
+    def recent_ms(self):
+        return math.exp(self.recent)
+
+    def baseline_ms(self):
+        return math.exp(self.baseline)
+
+# Per-endpoint anomaly detectors, by endpoint name
+DETECTORS = {}
+
+def get_detector(name):
+    """Return the AnomalyDetector of an endpoint, creating it if needed"""
+    with _stats_lock:
+        detector = DETECTORS.get(name)
+        if detector is None:
+            detector = DETECTORS[name] = AnomalyDetector()
+        return detector
+
+def emit_anomaly(kind, result):
+    """Log an anomaly start or end and pass it to the EVENT_LISTENERS"""
+    detector = get_detector(result['name'])
+    event = {
+        "event": f"latency_{kind}",
+        "name": result['name'],
+        "url": result['url'],
+        "response_time_ms": result['response_time_ms'],
+        "recent_ms": round(detector.recent_ms(), 2),
+        "baseline_ms": round(detector.baseline_ms(), 2),
+        "score": round(detector.score, 2),
+        "timestamp": result['timestamp'],
+    }
+    if kind == "anomaly":
+        log_message(
+            f"Anomaly: {result['name']} latency {event['recent_ms']}ms vs baseline "
+            f"{event['baseline_ms']}ms (score {event['score']})",
+            "WARNING"
+        )
+    else:
+        log_message(
+            f"Anomaly over: {result['name']} latency {event['recent_ms']}ms vs baseline "
+            f"{event['baseline_ms']}ms"
+        )
+    for listener in EVENT_LISTENERS:
+        listener(event)
+
+def format_stats(name):
+    """One line summary of an endpoint's rolling statistics"""
+    summary = get_stats(name).summary()
+    if summary['checks'] == 0:
+        return f"{name} - no data"
+    line = f"{name} - success: {summary['success_ratio'] * 100:.1f}% of {summary['checks']}"
+    if summary['p50'] is not None:
+        line += (
+            f" - p50/p95/p99: {summary['p50']}/{summary['p95']}/{summary['p99']}ms"
+            f" - min/max: {summary['min']}/{summary['max']}ms"
+        )
+    if summary['phases']:
+        p95 = "/".join(str(summary['phases'].get(phase, {}).get('p95', '-')) for phase in TIMING_PHASES)
+        line += f" - p95 dns/connect/tls/ttfb/body: {p95}ms"
+    return line
+
+class ResultStore:
+    """
+    Check history in SQLite (WAL mode)
+    Raw results (timestamp, endpoint, status, latency, error) are indexed by
+    endpoint and time. Completed 1m/5m/1h buckets are rolled up into
+    aggregates, and each resolution is pruned after its STORE_RETENTION,
+    so disk usage stays bounded over months of monitoring.
+    """
+
+    def __init__(self, path, batch_size=STORE_BATCH_SIZE, flush_interval=STORE_FLUSH_INTERVAL,
+                 rollup_interval=STORE_ROLLUP_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rollup_interval = rollup_interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._last_rollup = time.monotonic()
+        self._endpoint_ids = {}
+        
+        import sqlite3
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS endpoints (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                endpoint_id INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                status INTEGER,
+                latency_ms REAL,
+                success INTEGER NOT NULL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS results_endpoint_ts ON results (endpoint_id, ts);
+            CREATE TABLE IF NOT EXISTS rollups (
+                resolution TEXT NOT NULL,
+                endpoint_id INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                checks INTEGER NOT NULL,
+                failures INTEGER NOT NULL,
+                latency_count INTEGER NOT NULL,
+                latency_sum REAL,
+                latency_min REAL,
+                latency_max REAL,
+                PRIMARY KEY (resolution, endpoint_id, bucket)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                resolution TEXT PRIMARY KEY,
+                rolled_until INTEGER NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def _endpoint_id(self, name):
+        endpoint_id = self._endpoint_ids.get(name)
+        if endpoint_id is None:
+            self._db.execute("INSERT OR IGNORE INTO endpoints (name) VALUES (?)", (name,))
+            endpoint_id = self._db.execute(
+                "SELECT id FROM endpoints WHERE name = ?", (name,)
+            ).fetchone()[0]
+            self._endpoint_ids[name] = endpoint_id
+        return endpoint_id
+
+    def add(self, result):
+        """Buffer a check result, writing the batch when it is due"""
+        with self._lock:
+            self._pending.append(result)
+            if (len(self._pending) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush()
+                if time.monotonic() - self._last_rollup >= self.rollup_interval:
+                    self._rollup(time.time())
+
+    def flush(self):
+        """Write buffered results now"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        rows = []
+        for result in self._pending:
+            ts = datetime.fromisoformat(result['timestamp']).timestamp()
+            rows.append((
+                self._endpoint_id(result['name']),
+                ts,
+                result.get('status_code'),
+                result.get('response_time_ms'),
+                1 if result.get('success') else 0,
+                result.get('error'),
+            ))
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO results (endpoint_id, ts, status, latency_ms, success, error) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
             )
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def rollup(self, now=None):
+        """Aggregate completed buckets and apply retention"""
+        with self._lock:
+            self._flush()
+            self._rollup(time.time() if now is None else now)
+
+    def _rollup(self, now):
+        with self._db:
+            for resolution, seconds in STORE_ROLLUPS.items():
+                row = self._db.execute(
+                    "SELECT rolled_until FROM rollup_state WHERE resolution = ?", (resolution,)
+                ).fetchone()
+                rolled_until = row[0] if row else 0
+                until = int(now // seconds * seconds)  # start of the current, incomplete bucket
+                if until <= rolled_until:
+                    continue
+                self._db.execute("""
+                    INSERT INTO rollups (resolution, endpoint_id, bucket, checks, failures,
+                                         latency_count, latency_sum, latency_min, latency_max)
+                    SELECT ?, endpoint_id, CAST(ts / ? AS INTEGER) * ?, COUNT(*), SUM(1 - success),
+                           COUNT(latency_ms), SUM(latency_ms), MIN(latency_ms), MAX(latency_ms)
+                    FROM results WHERE ts >= ? AND ts < ?
+                    GROUP BY endpoint_id, CAST(ts / ? AS INTEGER)
+                    ON CONFLICT (resolution, endpoint_id, bucket) DO UPDATE SET
+                        checks = checks + excluded.checks,
+                        failures = failures + excluded.failures,
+                        latency_count = latency_count + excluded.latency_count,
+                        latency_sum = COALESCE(latency_sum, 0) + COALESCE(excluded.latency_sum, 0),
+                        latency_min = MIN(COALESCE(latency_min, excluded.latency_min),
+                                          COALESCE(excluded.latency_min, latency_min)),
+                        latency_max = MAX(COALESCE(latency_max, excluded.latency_max),
+                                          COALESCE(excluded.latency_max, latency_max))
+                """, (resolution, seconds, seconds, rolled_until, until, seconds))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO rollup_state (resolution, rolled_until) VALUES (?, ?)",
+                    (resolution, until)
+                )
+                self._db.execute(
+                    "DELETE FROM rollups WHERE resolution = ? AND bucket < ?",
+                    (resolution, now - STORE_RETENTION[resolution])
+                )
+            self._db.execute("DELETE FROM results WHERE ts < ?", (now - STORE_RETENTION['raw'],))
+        self._last_rollup = time.monotonic()
+
+    def query(self, name, start=None, end=None, resolution="raw"):
+        """
+        History of one endpoint between start and end (epoch seconds)
+        Args:
+            resolution: "raw" for individual checks, or one of STORE_ROLLUPS
+        Returns: list of dictionaries, oldest first
+        """
+        start = 0 if start is None else start
+        end = float('inf') if end is None else end
+        with self._lock:
+            self._flush()
+            endpoint = self._db.execute("SELECT id FROM endpoints WHERE name = ?", (name,)).fetchone()
+            if endpoint is None:
+                return []
+            if resolution == "raw":
+                rows = self._db.execute(
+                    "SELECT ts, status, latency_ms, success, error FROM results "
+                    "WHERE endpoint_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                    (endpoint[0], start, end)
+                ).fetchall()
+                return [
+                    {"ts": ts, "status_code": status, "response_time_ms": latency,
+                     "success": bool(success), "error": error}
+                    for ts, status, latency, success, error in rows
+                ]
+            if resolution not in STORE_ROLLUPS:
+                raise ValueError(f"Unknown resolution: {resolution}")
+            rows = self._db.execute(
+                "SELECT bucket, checks, failures, latency_count, latency_sum, latency_min, latency_max "
+                "FROM rollups WHERE resolution = ? AND endpoint_id = ? AND bucket >= ? AND bucket < ? "
+                "ORDER BY bucket",
+                (resolution, endpoint[0], start, end)
+            ).fetchall()
+            return [
+                {"ts": bucket, "checks": checks, "failures": failures,
+                 "avg_ms": latency_sum / latency_count if latency_count else None,
+                 "min_ms": latency_min, "max_ms": latency_max}
+                for bucket, checks, failures, latency_count, latency_sum, latency_min, latency_max in rows
+            ]
+
+    def close(self):
+        """Write buffered results and close the database"""
+        with self._lock:
+            if self._db is None:
+                return
+            self._flush()
+            self._db.close()
+            self._db = None
+
+def error_kind(result):
+    """Classify a failed result into a small, fixed set of error kinds"""
+    error = result.get('error')
+    if error is None:
+        return "status"
+    if error == "Timeout":
+        return "timeout"
+    if error == "Connection refused":
+        return "connection"
+    if error == "Body mismatch":
+        return "body"
+    return "other"
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MetricsRegistry:
+    """
+    Per-endpoint metrics, pre-aggregated for Prometheus scrapes
+    observe() updates a few counters per result; render() only walks the
+    endpoints, so a scrape is O(endpoints) and holds the lock just long
+    enough to copy them
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def observe(self, result):
+        """Account for one check result"""
+        latency = result.get('response_time_ms')
+        with self._lock:
+            metrics = self._endpoints.get(result['name'])
+            if metrics is None:
+                metrics = self._endpoints[result['name']] = {
+                    "url": result['url'],
+                    "up": 0,
+                    "checks": 0,
+                    "errors": {},
+                    "bucket_counts": [0] * len(self.buckets),
+                    "latency_sum": 0.0,
+                    "latency_count": 0,
+                }
+            metrics['url'] = result['url']
+            metrics['up'] = 1 if result.get('success') else 0
+            metrics['checks'] += 1
+            if not result.get('success'):
+                kind = error_kind(result)
+                metrics['errors'][kind] = metrics['errors'].get(kind, 0) + 1
+            if latency is not None:
+                seconds = latency / 1000
+                for i, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        metrics['bucket_counts'][i] += 1
+                        break
+                metrics['latency_sum'] += seconds
+                metrics['latency_count'] += 1
+
+    def remove(self, name):
+        """Forget an endpoint that is no longer monitored"""
+        with self._lock:
+            self._endpoints.pop(name, None)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            snapshot = [
+                (name, dict(m, errors=dict(m['errors']), bucket_counts=list(m['bucket_counts'])))
+                for name, m in self._endpoints.items()
+            ]
         
-        return result
+        up = ["# HELP health_check_up Whether the last check of the endpoint passed",
+              "# TYPE health_check_up gauge"]
+        checks = ["# HELP health_check_checks_total Checks run against the endpoint",
+                  "# TYPE health_check_checks_total counter"]
+        errors = ["# HELP health_check_errors_total Failed checks by kind",
+                  "# TYPE health_check_errors_total counter"]
+        latency = ["# HELP health_check_response_time_seconds Response time of checks that got a response",
+                   "# TYPE health_check_response_time_seconds histogram"]
+        for name, m in snapshot:
+            labels = f'endpoint="{_escape_label(name)}",url="{_escape_label(m["url"])}"'
+            up.append(f"health_check_up{{{labels}}} {m['up']}")
+            checks.append(f"health_check_checks_total{{{labels}}} {m['checks']}")
+            for kind, count in sorted(m['errors'].items()):
+                errors.append(f'health_check_errors_total{{{labels},kind="{kind}"}} {count}')
+            cumulative = 0
+            for bound, count in zip(self.buckets, m['bucket_counts']):
+                cumulative += count
+                latency.append(f'health_check_response_time_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            latency.append(f'health_check_response_time_seconds_bucket{{{labels},le="+Inf"}} {m["latency_count"]}')
+            latency.append(f"health_check_response_time_seconds_sum{{{labels}}} {m['latency_sum']}")
+            latency.append(f"health_check_response_time_seconds_count{{{labels}}} {m['latency_count']}")
+        return "\n".join(up + checks + errors + latency) + "\n"
+
+def start_metrics_server(registry, port, host=METRICS_HOST):
+    """
+    Serve registry.render() on http://host:port/metrics from a daemon thread
+    Returns: the running server (call shutdown() to stop it)
+    """
+    import http.server
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes would flood the console
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+class NdjsonWriter:
+    """
+    Result listener writing each result as one compact JSON line
+    Lines are flushed as they are written, so consumers see every result as
+    soon as its probe finishes
+    """
+
+    def __init__(self, path=None):
+        self._file = open(path, 'a', encoding='utf-8') if path else sys.stdout
+        self._owns_file = path is not None
+        self._lock = threading.Lock()
+
+    def write(self, result):
+        line = json.dumps(result, separators=(',', ':'), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._owns_file and not self._file.closed:
+                self._file.close()
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker with exponential backoff
+    closed: every check runs; after `threshold` failures in a row it opens
+    open: checks are skipped until the backoff delay has passed
+    half_open: one trial check runs; success closes the circuit, failure
+    opens it again for twice as long (up to max_delay)
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, base_delay=BREAKER_BASE_DELAY,
+                 max_delay=BREAKER_MAX_DELAY, clock=time.monotonic):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0  # failures in a row
+        self.trips = 0  # times opened since last closed
+        self.open_until = None
+
+    def allow(self):
+        """Whether a check may run now (moves open -> half_open when due)"""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and self.clock() >= self.open_until:
+            self.state = "half_open"
+            return True
+        return False
+
+    def record(self, success):
+        """
+        Account for a check outcome
+        Returns: "opened" or "closed" when the state changed, else None
+        """
+        if success:
+            reopened = self.state != "closed"
+            self.state = "closed"
+            self.failures = 0
+            self.trips = 0
+            self.open_until = None
+            return "closed" if reopened else None
         
-    except requests.exceptions.Timeout:
-        log_message(f"✗ {endpoint['name']} - Timeout after {endpoint['timeout']}s", "ERROR")
-        return {
-            "name": endpoint['name'],
-            "url": endpoint['url'],
-            "success": False,
-            "error": "Timeout",
-            "timestamp": datetime.now().isoformat()
-        }
-    except requests.exceptions.ConnectionError:
-        log_message(f"✗ {endpoint['name']} - Connection refused", "ERROR")
-        return {
-            "name": endpoint['name'],
-            "url": endpoint['url'],
-            "success": False,
-            "error": "Connection refused",
-            "timestamp": datetime.now().isoformat()
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            self.state = "open"
+            self.open_until = self.clock() + self.delay()
+            self.trips += 1
+            return "opened"
+        return None
+
+    def delay(self):
+        """Seconds the circuit stays open on its next trip"""
+        return min(self.max_delay, self.base_delay * 2 ** self.trips)
+
+    def retry_in(self):
+        """Seconds until the next trial check (0 unless open)"""
+        if self.state != "open":
+            return 0
+        return max(0, self.open_until - self.clock())
+
+    def to_state(self):
+        return {"state": self.state, "failures": self.failures, "trips": self.trips,
+                "retry_in": round(self.retry_in(), 3)}
+
+    @classmethod
+    def from_state(cls, state, elapsed=0):
+        """
+        CircuitBreaker in a to_state() state, saved `elapsed` seconds ago
+        (time the monitor was down counts towards the backoff delay)
+        """
+        breaker = cls()
+        breaker.state = state['state']
+        breaker.failures = state['failures']
+        breaker.trips = state['trips']
+        if breaker.state == "open":
+            breaker.open_until = breaker.clock() + max(0, state['retry_in'] - elapsed)
+        elif breaker.state == "half_open":
+            # the trial in flight at shutdown never reported: open and due, so
+            # the next allow() starts a new one
+            breaker.state = "open"
+            breaker.open_until = breaker.clock()
+        return breaker
+
+# Per-endpoint circuit breakers, by endpoint name
+BREAKERS = {}
+
+def get_breaker(name):
+    """Return the CircuitBreaker of an endpoint, creating it if needed"""
+    with _stats_lock:
+        breaker = BREAKERS.get(name)
+        if breaker is None:
+            breaker = BREAKERS[name] = CircuitBreaker()
+        return breaker
+
+def forget_endpoint(name):
+    """Drop the per-endpoint state of an endpoint no longer monitored"""
+    with _stats_lock:
+        for registry in (LATENCY_STATS, DETECTORS, BREAKERS, LAST_RESULTS, VALIDATORS,
+                         _timeout_streaks):
+            registry.pop(name, None)
+
+REMOVAL_LISTENERS.append(forget_endpoint)
+
+def circuit_open_result(endpoint):
+    """
+    Result for an endpoint whose circuit is open, None when it may be checked
+    """
+    if not endpoint.get('circuit_breaker', CIRCUIT_BREAKER):
+        return None
+    breaker = get_breaker(endpoint['name'])
+    if breaker.allow():
+        return None
+    return {
+        "name": endpoint['name'],
+        "url": endpoint['url'],
+        "success": False,
+        "error": "Circuit open",
+        "skipped": True,
+        "retry_in_s": round(breaker.retry_in(), 1),
+        "timestamp": datetime.now().isoformat()
+    }
+
+def update_breaker(result, endpoint):
+    """Feed a check result to the endpoint's circuit breaker, if it has one enabled"""
+    if not endpoint.get('circuit_breaker', CIRCUIT_BREAKER):
+        return
+    breaker = get_breaker(result['name'])
+    change = breaker.record(result.get('success', False))
+    if change == "opened":
+        log_message(
+            f"Circuit opened for {result['name']} after {breaker.failures} failures, "
+            f"next trial in {breaker.retry_in():.0f}s",
+            "WARNING"
+        )
+    elif change == "closed":
+        log_message(f"Circuit closed for {result['name']}, checks resumed")
+
+def snapshot_state():
+    """
+    Compact copy of the per-endpoint monitor state: latency windows (adaptive
+    timeouts), anomaly baselines, circuit breakers, last results, validators
+    of conditional endpoints and adaptive timeout streaks
+    """
+    with _stats_lock:
+        stats = dict(LATENCY_STATS)
+        detectors = dict(DETECTORS)
+        breakers = dict(BREAKERS)
+        state = {
+            "version": STATE_VERSION,
+            "saved_at": time.time(),
+            "last_results": dict(LAST_RESULTS),
+            "validators": {name: dict(v) for name, v in VALIDATORS.items()},
+            "timeout_streaks": dict(_timeout_streaks),
         }
-    except Exception as e:
-        log_message(f"✗ {endpoint['name']} - Error: {str(e)}", "ERROR")
-        return {
-            "name": endpoint['name'],
-            "url": endpoint['url'],
-            "success": False,
-            "error": str(e),
-            "timestamp": datetime.now().isoformat()
+    state["latency"] = {name: s.to_state() for name, s in stats.items()}
+    state["anomaly"] = {name: d.to_state() for name, d in detectors.items()}
+    state["breakers"] = {name: b.to_state() for name, b in breakers.items()}
+    return state
+
+def restore_state(state):
+    """
+    Load a snapshot_state() dictionary, replacing the state of the endpoints it covers
+    Returns: number of endpoints restored
+    """
+    if state.get('version') != STATE_VERSION:
+        raise ValueError(f"unsupported state version {state.get('version')!r}")
+    elapsed = max(0, time.time() - state['saved_at'])
+    stats = {name: LatencyStats.from_state(s) for name, s in state['latency'].items()}
+    detectors = {name: AnomalyDetector.from_state(d) for name, d in state['anomaly'].items()}
+    breakers = {name: CircuitBreaker.from_state(b, elapsed) for name, b in state['breakers'].items()}
+    with _stats_lock:
+        LATENCY_STATS.update(stats)
+        DETECTORS.update(detectors)
+        BREAKERS.update(breakers)
+        LAST_RESULTS.update(state['last_results'])
+        VALIDATORS.update(state['validators'])
+        _timeout_streaks.update(state['timeout_streaks'])
+    return len(set(stats) | set(detectors) | set(breakers) | set(state['last_results']))
+
+def save_state(path):
+    """Write a snapshot of the monitor state as compact JSON, replacing the file atomically"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(snapshot_state(), f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+def _save_state_in_background(path):
+    try:
+        save_state(path)
+    except OSError as e:
+        log_message(f"Could not save monitor state to {path}: {e}", "WARNING")
+
+def load_state(path):
+    """
+    Warm start from a save_state() file; a missing or unreadable file means a cold start
+    Returns: number of endpoints restored
+    """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+        restored = restore_state(state)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log_message(f"Ignoring monitor state {path}: {e}", "WARNING")
+        return 0
+    age = max(0, time.time() - state['saved_at'])
+    log_message(f"Restored state of {restored} endpoints from {path} (saved {age:.0f}s ago)")
+    return restored
+
+def _hash64(key):
+    """Stable 64-bit hash of a string, the same in every process and node"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping & Veach) of key into [0, buckets)
+    Going from n to n+1 buckets only moves 1/(n+1) of the keys, all to the new one
+    """
+    h = _hash64(key)
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        h = (h * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (1 << 31) / ((h >> 33) + 1))
+    return b
+
+class HashRing:
+    """
+    Consistent-hash ring of monitor IDs
+    Each monitor owns `replicas` points on the ring; adding or removing one
+    only moves the keys between its points and their neighbours
+    """
+
+    def __init__(self, monitors, replicas=SHARD_RING_REPLICAS):
+        if not monitors:
+            raise ValueError("Hash ring needs at least one monitor")
+        points = sorted(
+            (_hash64(f"{monitor}#{i}"), monitor)
+            for monitor in set(monitors) for i in range(replicas)
+        )
+        self.monitors = sorted(set(monitors))
+        self._hashes = [h for h, _ in points]
+        self._owners = [monitor for _, monitor in points]
+
+    def owner(self, key):
+        """Monitor ID owning key"""
+        i = bisect(self._hashes, _hash64(key)) % len(self._hashes)
+        return self._owners[i]
+
+class Shard:
+    """
+    Slice of the endpoint list probed by one monitor instance
+    Either shard `index` of `count` (jump consistent hash), or the endpoints
+    owned by `monitor_id` on a HashRing of monitor IDs
+    """
+
+    def __init__(self, index=0, count=1, ring=None, monitor_id=None):
+        if ring is not None:
+            if monitor_id not in ring.monitors:
+                raise ValueError(f"Monitor {monitor_id!r} is not on the ring")
+        elif not 0 <= index < count:
+            raise ValueError(f"Shard index {index} out of range for {count} shards")
+        self.index = index
+        self.count = count
+        self.ring = ring
+        self.monitor_id = monitor_id
+
+    @classmethod
+    def parse(cls, spec):
+        """Shard from an INDEX/COUNT string, e.g. 0/4"""
+        try:
+            index, count = (int(part) for part in spec.split('/'))
+        except ValueError:
+            raise ValueError(f"Invalid shard {spec!r}, expected INDEX/COUNT")
+        return cls(index, count)
+
+    def owns(self, endpoint):
+        """Whether this monitor probes the endpoint"""
+        if self.ring is not None:
+            return self.ring.owner(endpoint['name']) == self.monitor_id
+        return jump_hash(endpoint['name'], self.count) == self.index
+
+    def select(self, endpoints):
+        """The endpoints this monitor probes"""
+        return [e for e in endpoints if self.owns(e)]
+
+    def __str__(self):
+        if self.ring is not None:
+            return f"{self.monitor_id} of {len(self.ring.monitors)} monitors"
+        return f"{self.index}/{self.count}"
+
+def summarize(results, shard=None):
+    """
+    Mergeable summary of one monitor's latest results
+    Returns: dictionary with pass/fail counts and the latest result of each
+    endpoint, suitable for merge_summaries
+    """
+    endpoints = {}
+    for result in results:
+        stats = get_stats(result['name']).summary()
+        endpoints[result['name']] = {
+            "success": result.get('success', False),
+            "skipped": result.get('skipped', False),
+            "status_code": result.get('status_code'),
+            "response_time_ms": result.get('response_time_ms'),
+            "error": result.get('error'),
+            "timestamp": result.get('timestamp'),
+            "checks": stats['checks'],
+            "success_ratio": stats['success_ratio'],
         }
+    return _summary_totals({
+        "shards": [str(shard) if shard is not None else "all"],
+        "endpoints": endpoints,
+    })
+
+def merge_summaries(summaries):
+    """
+    Merge the summaries of several monitors into one
+    An endpoint reported by more than one monitor (e.g. while a shard moves)
+    keeps its most recent result
+    """
+    shards, endpoints = [], {}
+    for summary in summaries:
+        shards += summary['shards']
+        for name, entry in summary['endpoints'].items():
+            current = endpoints.get(name)
+            if current is None or (entry['timestamp'] or '') > (current['timestamp'] or ''):
+                endpoints[name] = entry
+    return _summary_totals({"shards": shards, "endpoints": endpoints})
+
+def _summary_totals(summary):
+    """Add pass/fail counts and latency percentiles to a summary"""
+    entries = summary['endpoints'].values()
+    skipped = sum(1 for e in entries if e['skipped'])
+    passed = sum(1 for e in entries if e['success'])
+    latencies = sorted(e['response_time_ms'] for e in entries if e['response_time_ms'] is not None)
+    summary.update({
+        "total": len(summary['endpoints']) - skipped,
+        "passed": passed,
+        "failed": len(summary['endpoints']) - skipped - passed,
+        "skipped": skipped,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    })
+    return summary
+
+def write_summary(summary, path):
+    """Write a summary as JSON, replacing the file atomically"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp, path)
+
+def _probe_worker(tasks, results, threads, pool_size, pool_idle_timeout, settings):
+    """
+    Worker process of a ProcessProbePool
+    Probes each (batch of (index, endpoint), per_host) from tasks on its own
+    threads and SessionPool, hosts taking turns like in check_endpoints, and
+    puts (index, result, log lines) on results as checks finish
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl+C
+    globals().update(settings)
+    pool = SessionPool(pool_size, pool_idle_timeout)
+    
+    def probe(item):
+        index, endpoint = item
+        _log_capture.lines = []
+        try:
+            session = None
+            if endpoint.get('engine', DEFAULT_ENGINE) == "requests":
+                session = pool.get(endpoint['url'])
+            result = check_endpoint(endpoint, session)
+        finally:
+            lines, _log_capture.lines = _log_capture.lines, None
+        results.put((index, result, lines))
+    
+    def work(dispatcher, batch):
+        while True:
+            taken = dispatcher.take()
+            if taken is None:
+                return
+            host, position, _ = taken
+            try:
+                probe(batch[position])
+            finally:
+                dispatcher.done(host)
+    
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for batch, per_host in iter(tasks.get, None):
+            pool.evict_idle()
+            dispatcher = ProbeDispatcher([endpoint for _, endpoint in batch], per_host)
+            workers = min(threads, len(batch), per_host * dispatcher.hosts)
+            for future in [executor.submit(work, dispatcher, batch) for _ in range(workers)]:
+                future.result()
+    pool.close()
+
+class ProcessProbePool:
+    """
+    Worker processes probing endpoints for run_health_checks
+    All the endpoints of a host are always sent to the same worker, so its
+    keep-alive connections stay warm and its per_host limit holds across
+    workers. Results stream back as they finish and are logged, recorded
+    and fed to the breakers in this process.
+    """
+
+    def __init__(self, processes=None, threads=PROCESS_THREADS,
+                 pool_size=POOL_SIZE, pool_idle_timeout=POOL_IDLE_TIMEOUT):
+        import multiprocessing
+        context = multiprocessing.get_context("spawn")
+        processes = processes or os.cpu_count() or 1
+        settings = {"DEFAULT_ENGINE": DEFAULT_ENGINE, "DNS_CACHE_TTL": DNS_CACHE_TTL}
+        self._results = context.Queue()
+        self._tasks = [context.Queue() for _ in range(processes)]
+        self._workers = [
+            context.Process(
+                target=_probe_worker,
+                args=(tasks, self._results, threads, pool_size, pool_idle_timeout, settings),
+                daemon=True
+            )
+            for tasks in self._tasks
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def check_endpoints(self, endpoints, per_host=PER_HOST):
+        """
+        Check a list of endpoints on the worker processes
+        Args:
+            endpoints: list of endpoint definitions
+            per_host: maximum number of checks in flight to one host
+        Returns: list of results, in the same order as endpoints
+        """
+        results = [None] * len(endpoints)
+        adaptive = {}
+        batches = [[] for _ in self._tasks]
+        for index, endpoint in enumerate(endpoints):
+            skipped = circuit_open_result(endpoint)
+            if skipped is not None:
+                results[index] = skipped
+                continue
+            # Timeouts are learned here, where the statistics are
+            endpoint, adaptive_timeout = apply_timeout(endpoint)
+            if adaptive_timeout is not None:
+                adaptive[index] = adaptive_timeout
+                endpoint = dict(endpoint, adaptive_timeout=False)
+            if endpoint.get('conditional') and endpoint['name'] in VALIDATORS:
+                endpoint = dict(endpoint, validators=VALIDATORS[endpoint['name']])
+            host, port = ProbeDispatcher.host(endpoint)
+            worker = jump_hash(f"{host}:{port}", len(self._tasks))
+            batches[worker].append((index, endpoint))
+        
+        pending = 0
+        for tasks, batch in zip(self._tasks, batches):
+            if batch:
+                tasks.put((batch, per_host))
+                pending += len(batch)
+        
+        while pending:
+            try:
+                index, result, lines = self._results.get(timeout=1)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self._workers):
+                    raise RuntimeError("A probe worker process exited")
+                continue
+            pending -= 1
+            for message, level in lines:
+                log_message(message, level)
+            if index in adaptive:
+                result['adaptive_timeout'] = adaptive[index]
+            record_result(result)
+            update_breaker(result, endpoints[index])
+            results[index] = result
+        return results
+
+    def close(self):
+        """Stop the worker processes"""
+        for tasks in self._tasks:
+            tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+class ProbeDispatcher:
+    """
+    Fair queue of the checks of a cycle, for the threaded and async monitors
+    Checks wait in one FIFO per host and hosts take turns (round robin), so
+    a host with hundreds of endpoints does not hold back the others. A host
+    with per_host checks in flight is skipped until one of them finishes.
+    The overall limit is the number of threads (or tasks) taking checks.
+    """
+
+    def __init__(self, endpoints, per_host=PER_HOST):
+        self.per_host = per_host
+        self._queues = OrderedDict()  # host -> deque of (index, endpoint), in turn order
+        self._in_flight = {}  # host -> checks in flight
+        self._cond = threading.Condition(threading.RLock())  # poll() runs inside take()
+        for index, endpoint in enumerate(endpoints):
+            host = self.host(endpoint)
+            self._queues.setdefault(host, deque()).append((index, endpoint))
+            self._in_flight[host] = 0
+        self.hosts = len(self._queues)
+
+    @staticmethod
+    def host(endpoint):
+        parts = urlsplit(endpoint['url'])
+        return parts.hostname, parts.port
 
-def run_health_checks():
-    """Run health checks on all endpoints"""
+    @property
+    def pending(self):
+        """Whether checks are still waiting"""
+        return bool(self._queues)
+
+    def poll(self):
+        """
+        Next check, from the next host in turn that is under its limit
+        Returns: (host, index, endpoint), or None when no check can start now
+        """
+        with self._cond:
+            for _ in range(len(self._queues)):
+                host, waiting = next(iter(self._queues.items()))
+                self._queues.move_to_end(host)
+                if self._in_flight[host] < self.per_host:
+                    index, endpoint = waiting.popleft()
+                    if not waiting:
+                        del self._queues[host]
+                    self._in_flight[host] += 1
+                    return host, index, endpoint
+            return None
+
+    def take(self):
+        """
+        poll() for threads: blocks while every host with checks waiting is at its limit
+        Returns: (host, index, endpoint), or None when no check is left
+        """
+        with self._cond:
+            while self._queues:
+                taken = self.poll()
+                if taken is not None:
+                    return taken
+                self._cond.wait()
+            return None
+
+    def done(self, host):
+        """Account for a finished check of host"""
+        with self._cond:
+            self._in_flight[host] -= 1
+            self._cond.notify_all()
+
+def check_endpoints(endpoints, max_workers=MAX_WORKERS, pool=None, per_host=PER_HOST):
+    """
+    Check a list of endpoints
+    Args:
+        endpoints: list of endpoint definitions
+        max_workers: maximum number of checks in flight at once
+        pool: SessionPool to reuse connections across checks (optional)
+        per_host: maximum number of checks in flight to one host
+    Returns: list of results, in the same order as endpoints
+    """
+    def probe(endpoint):
+        session = None
+        if pool is not None and endpoint.get('engine', DEFAULT_ENGINE) == "requests":
+            session = pool.get(endpoint['url'])
+        result = check_endpoint(endpoint, session)
+        record_result(result)
+        update_breaker(result, endpoint)
+        return result
+    
+    def check(endpoint):
+        # circuit_open_result() lets the one half-open trial through: call it once per check
+        skipped = circuit_open_result(endpoint)
+        return skipped if skipped is not None else probe(endpoint)
+    
+    if max_workers <= 1:
+        results = []
+        probed = False
+        for endpoint in endpoints:
+            skipped = circuit_open_result(endpoint)
+            if skipped is not None:
+                results.append(skipped)
+                continue
+            if probed:
+                time.sleep(1)  # Small pause between checks
+            results.append(probe(endpoint))
+            probed = True
+        return results
+    
+    # Concurrent mode: the cycle takes about as long as the slowest endpoint,
+    # or its busiest host when that host is at its per_host limit
+    results = [None] * len(endpoints)
+    dispatcher = ProbeDispatcher(endpoints, per_host)
+    def work():
+        while True:
+            taken = dispatcher.take()
+            if taken is None:
+                return
+            host, index, endpoint = taken
+            try:
+                results[index] = check(endpoint)
+            finally:
+                dispatcher.done(host)
+    
+    workers = min(max_workers, len(endpoints), per_host * dispatcher.hosts) or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(work) for _ in range(workers)]:
+            future.result()
+    return results
+
+def run_health_checks(endpoints=None, max_workers=MAX_WORKERS, pool=None, per_host=PER_HOST):
+    """
+    Run health checks on all endpoints
+    Args:
+        endpoints: list of endpoints to check (defaults to ENDPOINTS)
+        max_workers: maximum number of checks in flight at once
+        per_host: maximum number of checks in flight to one host
+        pool: SessionPool to reuse connections across cycles, or a
+              ProcessProbePool to spread the checks over worker processes (optional)
+    """
+    if endpoints is None:
+        endpoints = ENDPOINTS
+    
     log_message("=" * 60)
     log_message("Starting health checks...")
     
-    results = []
-    for endpoint in ENDPOINTS:
-        result = check_endpoint(endpoint)
-        results.append(result)
-        time.sleep(1)  # Small pause between checks
+    if isinstance(pool, ProcessProbePool):
+        results = pool.check_endpoints(endpoints, per_host)
+    else:
+        if pool is not None:
+            pool.evict_idle()
+        results = check_endpoints(endpoints, max_workers, pool, per_host)
     
-    # Summary
-    total = len(results)
+    log_summary(endpoints, results)
+    return results
+
+def log_summary(endpoints, results):
+    """Log the end-of-cycle summary and per-endpoint statistics"""
+    skipped = sum(1 for r in results if r.get('skipped'))
+    total = len(results) - skipped
     successful = sum(1 for r in results if r.get('success', False))
     failed = total - successful
     
     log_message("-" * 60)
-    log_message(f"Summary: {successful}/{total} checks passed, {failed} failed")
+    summary = f"Summary: {successful}/{total} checks passed, {failed} failed"
+    if skipped:
+        summary += f", {skipped} skipped (circuit open)"
+    log_message(summary)
+    for endpoint in endpoints:
+        log_message(f"  {format_stats(endpoint['name'])}")
+    log_message("=" * 60)
+
+class AsyncConnectionPool:
+    """
+    Keep-alive HTTP/1.1 connections for the asyncio monitor
+    Idle connections are kept per (host, port, tls) and reused while younger
+    than idle_timeout; a semaphore per host caps requests in flight to it
+    """
+
+    def __init__(self, per_host=ASYNC_PER_HOST, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.per_host = per_host
+        self.idle_timeout = idle_timeout
+        self.opened = 0
+        self.reused = 0
+        self._idle = {}  # key -> [(reader, writer, last_used)]
+        self._limits = {}  # key -> asyncio.Semaphore
+
+    def limit(self, key):
+        """Semaphore capping requests in flight to one host"""
+        import asyncio
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = asyncio.Semaphore(self.per_host)
+        return limit
+
+    async def acquire(self, key):
+        """
+        Connection to key, reusing an idle one when possible
+        Returns: (reader, writer, reused)
+        """
+        idle = self._idle.get(key)
+        now = time.monotonic()
+        while idle:
+            reader, writer, last_used = idle.pop()
+            if (now - last_used < self.idle_timeout
+                    and not reader.at_eof() and not writer.is_closing()):
+                self.reused += 1
+                return reader, writer, True
+            writer.close()
+        
+        host, port, tls = key
+        reader, writer = await _async_connect(host, port, get_tls_context() if tls else None)
+        self.opened += 1
+        return reader, writer, False
+
+    def release(self, key, reader, writer, reusable):
+        """Return a connection after a request, closing it unless reusable"""
+        if reusable:
+            self._idle.setdefault(key, []).append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    def close(self):
+        """Close all idle connections"""
+        for connections in self._idle.values():
+            for _, writer, _ in connections:
+                writer.close()
+        self._idle.clear()
+
+async def _async_connect(host, port, ssl_context=None):
+    """
+    asyncio.open_connection to the first reachable address of host, resolved
+    through the DNS cache when it is on
+    Returns: (reader, writer)
+    """
+    import asyncio
+    if get_dns_cache() is None:
+        return await asyncio.open_connection(host, port, ssl=ssl_context)
+    addresses = await resolve_async(host, port)
+    for *_, address in addresses:
+        try:
+            return await asyncio.open_connection(
+                address[0], port, ssl=ssl_context,
+                server_hostname=host if ssl_context is not None else None
+            )
+        except OSError:
+            if address == addresses[-1][4]:
+                raise
+
+async def _async_body(reader, headers, scanner):
+    """
+    Read (or scan) a response body
+    Returns: (whether the body was read to its end, so the connection can
+    carry another request, bytes read)
+    """
+    import asyncio
+    received = 0
+    def feed(chunk):
+        nonlocal received
+        received += len(chunk)
+        return scanner is not None and scanner.feed(chunk)
+    
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass  # trailers
+                return True, received
+            chunk = await reader.readexactly(size)
+            await reader.readexactly(2)
+            if feed(chunk):
+                return False, received
+    
+    length = headers.get('content-length')
+    if length is not None:
+        remaining = int(length)
+        while remaining:
+            chunk = await reader.read(min(remaining, BODY_CHUNK_SIZE))
+            if not chunk:
+                raise asyncio.IncompleteReadError(chunk, remaining)
+            remaining -= len(chunk)
+            if feed(chunk):
+                return remaining == 0, received
+        return True, received
+    
+    # No length: the body runs until the server closes the connection
+    while True:
+        chunk = await reader.read(BODY_CHUNK_SIZE)
+        if not chunk or feed(chunk):
+            return False, received
+
+async def _async_http_get(endpoint, reader, writer, host, port, tls, path):
+    """
+    Send a GET (or HEAD) on an open connection and read the response
+    Returns: (outcome dictionary, whether the connection is reusable)
+    """
+    method = probe_method(endpoint)
+    sent_headers = request_headers(endpoint)
+    default_port = 443 if tls else 80
+    lines = [
+        f"{method} {path} HTTP/1.1",
+        f"Host: {host}" if port == default_port else f"Host: {host}:{port}",
+        "Connection: keep-alive",
+    ]
+    lines += [f"{name}: {value}" for name, value in sent_headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+    await writer.drain()
+    
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("Connection closed by server")
+    version, status = status_line.decode('latin-1').split(None, 2)[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    
+    status_code = int(status)
+    marker = endpoint.get('body_contains')
+    scanner = BodyScanner(marker, endpoint.get('max_body_bytes', BODY_MAX_BYTES)) if marker else None
+    if method == "HEAD" or status_code in (204, 304) or 100 <= status_code < 200:
+        complete, received = True, 0
+        scanner = None
+    else:
+        complete, received = await _async_body(reader, headers, scanner)
+    
+    outcome = {"status_code": status_code}
+    if scanner is not None:
+        outcome['body_match'] = scanner.found
+        outcome['body_bytes_read'] = scanner.read
+    outcome.update(response_details(endpoint, status_code, headers, received, sent_headers))
+    reusable = complete and version == "HTTP/1.1" and headers.get('connection', '').lower() != 'close'
+    return outcome, reusable
+
+async def _async_probe(endpoint, pool):
+    """
+    Probe an endpoint on the event loop: connect check for the tcp engine,
+    a worker thread for transactions, otherwise a GET on a pooled keep-alive
+    connection
+    Returns: outcome dictionary, like the threaded engines
+    """
+    import asyncio
+    engine = endpoint.get('engine', DEFAULT_ENGINE)
+    if engine == "transaction":
+        # Each step depends on the previous one, run them on a blocking connection
+        return await asyncio.to_thread(_probe_transaction, endpoint)
+    
+    host, port, tls, path = _target(endpoint)
+    key = (host, port, tls)
+    start_time = time.perf_counter()
+    try:
+        if engine == "tcp":
+            _, writer = await _async_connect(host, port, get_tls_context() if tls else None)
+            writer.close()
+            outcome = {"status_code": None}
+        else:
+            while True:
+                reader, writer, reused = await pool.acquire(key)
+                try:
+                    outcome, reusable = await _async_http_get(endpoint, reader, writer, host, port, tls, path)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if not reused:
+                        raise
+                    # The server dropped an idle keep-alive connection, retry on a new one
+                except BaseException:
+                    writer.close()
+                    raise
+            pool.release(key, reader, writer, reusable)
+    except (OSError, asyncio.IncompleteReadError) as e:
+        if isinstance(e, TimeoutError):
+            raise
+        raise ProbeConnectionError(str(e))
+    
+    outcome['response_time_ms'] = round((time.perf_counter() - start_time) * 1000, 2)
+    return outcome
+
+async def async_check_endpoint(endpoint, pool, limit=None):
+    """
+    Asyncio version of check_endpoint, returning the same result dictionary
+    Args:
+        endpoint: endpoint definition
+        pool: AsyncConnectionPool (its per-host semaphore is honoured)
+        limit: asyncio.Semaphore capping checks in flight overall (optional,
+               async_run_health_checks caps them with its number of tasks)
+    """
+    import asyncio
+    skipped = circuit_open_result(endpoint)
+    if skipped is not None:
+        return skipped
+    
+    endpoint, adaptive_timeout = apply_timeout(endpoint)
+    try:
+        host, port, tls, _ = _target(endpoint)
+        if limit is None:
+            limit = asyncio.Semaphore(1)  # nothing else shares it
+        # Per host first: a check waiting for a busy host must not hold a global slot
+        async with pool.limit((host, port, tls)), limit:
+            outcome = await asyncio.wait_for(_async_probe(endpoint, pool), endpoint['timeout'])
+        result = build_result(endpoint, outcome)
+    except asyncio.TimeoutError:
+        result = error_result(endpoint, ProbeTimeout())
+    except Exception as e:
+        result = error_result(endpoint, e)
+    if adaptive_timeout is not None:
+        result['adaptive_timeout'] = adaptive_timeout
+    
+    record_result(result)
+    update_breaker(result, endpoint)
+    return result
+
+async def async_run_health_checks(endpoints=None, concurrency=ASYNC_CONCURRENCY,
+                                  per_host=ASYNC_PER_HOST, pool=None):
+    """
+    Asyncio version of run_health_checks
+    Args:
+        endpoints: list of endpoints to check (defaults to ENDPOINTS)
+        concurrency: maximum number of checks in flight at once
+        per_host: maximum number of checks in flight to one host
+        pool: AsyncConnectionPool to reuse connections across cycles (optional,
+              must belong to the running event loop)
+    Returns: list of results, in the same order as endpoints
+    """
+    import asyncio
+    if endpoints is None:
+        endpoints = ENDPOINTS
+    
     log_message("=" * 60)
+    log_message("Starting health checks...")
     
+    own_pool = pool is None
+    if own_pool:
+        pool = AsyncConnectionPool(per_host)
+    
+    # concurrency tasks take checks from a ProbeDispatcher, like the threaded monitor
+    results = [None] * len(endpoints)
+    dispatcher = ProbeDispatcher(endpoints, per_host)
+    ready = asyncio.Condition()
+    async def work():
+        while True:
+            async with ready:
+                taken = dispatcher.poll()
+                while taken is None and dispatcher.pending:
+                    await ready.wait()
+                    taken = dispatcher.poll()
+            if taken is None:
+                return
+            host, index, endpoint = taken
+            try:
+                results[index] = await async_check_endpoint(endpoint, pool)
+            finally:
+                dispatcher.done(host)
+                async with ready:
+                    ready.notify_all()
+    
+    tasks = min(concurrency, len(endpoints), per_host * dispatcher.hosts)
+    try:
+        await asyncio.gather(*(work() for _ in range(tasks)))
+    finally:
+        if own_pool:
+            pool.close()
+    
+    log_summary(endpoints, results)
     return results
 
-def continuous_monitoring(interval=60):
+class EndpointScheduler:
+    """
+    Per-endpoint check deadlines kept in a heap, on the monotonic clock
+    Each endpoint runs every endpoint["interval"] seconds (default_interval
+    if missing), delayed by a random 0..endpoint["jitter"] seconds. Deadlines
+    stay on a fixed grid, so slow checks never push later runs back.
+    """
+
+    def __init__(self, default_interval=60, default_jitter=0, clock=time.monotonic):
+        self.default_interval = default_interval
+        self.default_jitter = default_jitter
+        self.clock = clock
+        self._heap = []  # (fire_time, token, name)
+        self._entries = {}  # name -> {"endpoint", "deadline", "token"}
+        self._tokens = itertools.count()
+
+    def interval(self, endpoint):
+        return endpoint.get('interval', self.default_interval)
+
+    def _push(self, entry):
+        entry['token'] = next(self._tokens)
+        jitter = entry['endpoint'].get('jitter', self.default_jitter)
+        fire_time = entry['deadline'] + (random.uniform(0, jitter) if jitter else 0)
+        heapq.heappush(self._heap, (fire_time, entry['token'], entry['endpoint']['name']))
+
+    def add(self, endpoint, start=None):
+        """Schedule an endpoint, first check at start (default: now)"""
+        deadline = self.clock() if start is None else start
+        entry = {"endpoint": endpoint, "deadline": deadline}
+        self._entries[endpoint['name']] = entry
+        self._push(entry)
+
+    def update(self, endpoint):
+        """Replace an endpoint definition, keeping its current deadline"""
+        entry = self._entries.get(endpoint['name'])
+        if entry is None:
+            self.add(endpoint)
+        else:
+            entry['endpoint'] = endpoint
+
+    def remove(self, name):
+        """Stop scheduling an endpoint"""
+        # Its heap item becomes stale and is dropped when it surfaces
+        self._entries.pop(name, None)
+
+    def _is_current(self, item):
+        entry = self._entries.get(item[2])
+        return entry is not None and entry['token'] == item[1]
+
+    def next_fire_time(self):
+        """Monotonic time of the next check, None when nothing is scheduled"""
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """Return endpoints whose check is due, removing them from the heap"""
+        if now is None:
+            now = self.clock()
+        due = []
+        while True:
+            fire_time = self.next_fire_time()
+            if fire_time is None or fire_time > now:
+                return due
+            _, _, name = heapq.heappop(self._heap)
+            due.append(self._entries[name]['endpoint'])
+
+    def reschedule(self, endpoint, finished_at=None):
+        """
+        Move an endpoint to its next deadline after a check
+        Args:
+            endpoint: endpoint returned by pop_due
+            finished_at: monotonic time the check finished (default: now)
+        Returns: number of deadlines missed because the check overran
+        """
+        entry = self._entries.get(endpoint['name'])
+        if entry is None:
+            return 0
+        if finished_at is None:
+            finished_at = self.clock()
+        interval = self.interval(entry['endpoint'])
+        entry['deadline'] += interval
+        missed = 0
+        if entry['deadline'] <= finished_at:
+            # Skip the slots we could not honour instead of running late
+            missed = int((finished_at - entry['deadline']) // interval) + 1
+            entry['deadline'] += missed * interval
+        self._push(entry)
+        return missed
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+def apply_config_changes(scheduler, watcher):
+    """Apply endpoint config file changes to a running scheduler"""
+    added, removed, changed = watcher.poll()
+    for endpoint in removed:
+        scheduler.remove(endpoint['name'])
+        for listener in REMOVAL_LISTENERS:
+            listener(endpoint['name'])
+    for endpoint in added:
+        scheduler.add(endpoint)
+    for endpoint in changed:
+        scheduler.update(endpoint)
+    if added or removed or changed:
+        log_message(
+            f"Config reloaded: {len(added)} added, {len(removed)} removed, "
+            f"{len(changed)} changed ({len(scheduler)} endpoints)"
+        )
+
+def continuous_monitoring(interval=60, max_workers=MAX_WORKERS,
+                          pool_size=POOL_SIZE, pool_idle_timeout=POOL_IDLE_TIMEOUT,
+                          jitter=0, config_path=None, use_async=False,
+                          concurrency=ASYNC_CONCURRENCY, per_host=None,
+                          shard=None, summary_path=None, processes=0,
+                          process_threads=PROCESS_THREADS, state_path=None, duration=None):
     """
     Continuous monitoring
     Args:
-        interval: seconds between each check
+        interval: seconds between each check (unless the endpoint sets its own)
+        max_workers: maximum number of checks in flight at once
+        pool_size: keep-alive connections kept per host
+        pool_idle_timeout: seconds before an unused host pool is closed
+        jitter: maximum random delay added to each check (unless the endpoint sets its own)
+        config_path: endpoint config file, reloaded on change (default: ENDPOINTS)
+        use_async: run checks on an asyncio event loop instead of threads
+        concurrency: asyncio checks in flight at once
+        per_host: checks in flight to one host (default: PER_HOST, or
+            ASYNC_PER_HOST with use_async)
+        shard: only probe the endpoints this Shard owns
+        summary_path: rewrite a mergeable JSON summary here after each batch
+        processes: probe on this many worker processes (0: in this process)
+        process_threads: checks in flight in each worker process
+        state_path: save a snapshot of the monitor state here every
+            STATE_SAVE_INTERVAL seconds and on exit
+        duration: stop after this many seconds (default: run until interrupted)
     """
     log_message(f"Starting continuous monitoring (interval: {interval}s)")
     log_message("Press Ctrl+C to stop")
     
+    watcher = EndpointConfigWatcher(config_path, shard) if config_path else None
+    endpoints = list(watcher.endpoints.values()) if watcher else ENDPOINTS
+    if shard is not None:
+        if watcher is None:
+            endpoints = shard.select(endpoints)
+        log_message(f"Shard {shard}: {len(endpoints)} endpoints")
+    latest = dict(LAST_RESULTS)  # name -> last result, for the summary
+    if per_host is None:
+        per_host = ASYNC_PER_HOST if use_async else PER_HOST
+    
+    if use_async:
+        import asyncio
+        loop = asyncio.new_event_loop()
+        pool = AsyncConnectionPool(per_host, pool_idle_timeout)
+        def run_batch(due):
+            return loop.run_until_complete(
+                async_run_health_checks(due, concurrency, per_host, pool=pool)
+            )
+    else:
+        if processes:
+            pool = ProcessProbePool(processes, process_threads, pool_size, pool_idle_timeout)
+        else:
+            pool = SessionPool(pool_size, pool_idle_timeout)
+        def run_batch(due):
+            return run_health_checks(due, max_workers=max_workers, pool=pool, per_host=per_host)
+    scheduler = EndpointScheduler(interval, jitter)
+    # before the first deadlines, so that no check is due when the time is up
+    stop_at = scheduler.clock() + duration if duration is not None else None
+    for endpoint in endpoints:
+        scheduler.add(endpoint)
+    next_config_poll = scheduler.clock() + CONFIG_POLL_INTERVAL
+    next_state_save = scheduler.clock() + STATE_SAVE_INTERVAL
+    saver = None  # thread writing the latest state snapshot
+    
     try:
         while True:
-            run_health_checks()
-            time.sleep(interval)
+            now = scheduler.clock()
+            if stop_at is not None and now >= stop_at:
+                break
+            if watcher is not None and now >= next_config_poll:
+                apply_config_changes(scheduler, watcher)
+                next_config_poll = now + CONFIG_POLL_INTERVAL
+            
+            fire_time = scheduler.next_fire_time()
+            wait = interval if fire_time is None else fire_time - now
+            if watcher is not None:
+                wait = min(wait, next_config_poll - now)
+            if stop_at is not None:
+                wait = min(wait, stop_at - now)
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            
+            due = scheduler.pop_due()
+            results = run_batch(due)
+            if summary_path:
+                latest.update((r['name'], r) for r in results)
+                latest = {name: r for name, r in latest.items() if name in scheduler}
+                write_summary(summarize(latest.values(), shard), summary_path)
+            
+            finished_at = scheduler.clock()
+            if state_path and finished_at >= next_state_save:
+                # Off the probe loop, so a slow disk does not delay checks
+                if saver is None or not saver.is_alive():
+                    saver = threading.Thread(target=_save_state_in_background,
+                                             args=(state_path,), daemon=True)
+                    saver.start()
+                next_state_save = finished_at + STATE_SAVE_INTERVAL
+            for endpoint in due:
+                missed = scheduler.reschedule(endpoint, finished_at)
+                if missed:
+                    log_message(
+                        f"Overrun: {endpoint['name']} missed {missed} scheduled "
+                        f"check(s) (interval: {scheduler.interval(endpoint)}s)",
+                        "WARNING"
+                    )
     except KeyboardInterrupt:
         log_message("Monitoring stopped by user")
         sys.exit(0)
+    finally:
+        pool.close()
+        if use_async:
+            loop.close()
+        if state_path:
+            if saver is not None:
+                saver.join()
+            save_state(state_path)
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == "--continuous":
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Health Check Monitor")
+    parser.add_argument(
+        "--continuous", nargs="?", type=int, const=60, metavar="INTERVAL",
+        help="run continuously, checking every INTERVAL seconds (default: 60)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=MAX_WORKERS,
+        help="maximum number of checks in flight at once (default: 1, sequential)"
+    )
+    parser.add_argument(
+        "--async", dest="use_async", action="store_true",
+        help="run checks on an asyncio event loop with keep-alive connections"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=ASYNC_CONCURRENCY,
+        help=f"--async: maximum number of checks in flight at once (default: {ASYNC_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--per-host", type=int,
+        help="maximum number of checks in flight to one host, hosts taking turns "
+             f"(default: {PER_HOST}, {ASYNC_PER_HOST} with --async)"
+    )
+    parser.add_argument(
+        "--processes", type=int, default=0,
+        help="spread the checks over this many worker processes, each with its own "
+             "connection pool (default: 0, checks run in this process)"
+    )
+    parser.add_argument(
+        "--process-threads", type=int, default=PROCESS_THREADS,
+        help=f"--processes: checks in flight in each worker process (default: {PROCESS_THREADS})"
+    )
+    parser.add_argument(
+        "--pool-size", type=int, default=POOL_SIZE,
+        help=f"keep-alive connections kept per host (default: {POOL_SIZE})"
+    )
+    parser.add_argument(
+        "--pool-idle-timeout", type=float, default=POOL_IDLE_TIMEOUT,
+        help=f"seconds before an unused host pool is closed (default: {POOL_IDLE_TIMEOUT})"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0,
+        help="maximum random delay in seconds added to each scheduled check (default: 0)"
+    )
+    parser.add_argument(
+        "--buffered-log", action="store_true",
+        help="keep the log file open and write it in batches from a background thread"
+    )
+    parser.add_argument(
+        "--quiet", action="store_true",
+        help="do not print log messages to the console"
+    )
+    parser.add_argument(
+        "--engine", choices=list(PROBE_ENGINES), default=DEFAULT_ENGINE,
+        help="probe engine for endpoints that do not set one (http/timed: stdlib GET "
+             "with DNS/connect/TLS/TTFB/body breakdown, tcp: connect check only)"
+    )
+    parser.add_argument(
+        "--dns-ttl", type=float, default=DNS_CACHE_TTL, metavar="SECONDS",
+        help="cache the DNS lookups of the probes' new connections for "
+             "SECONDS, re-resolving names in use in the background (default: 0, no cache)"
+    )
+    parser.add_argument(
+        "--adaptive-timeout", action="store_true",
+        help="derive each endpoint's timeout from its recent p99 latency "
+             "(capped by its configured timeout)"
+    )
+    parser.add_argument(
+        "--adaptive-factor", type=float, default=ADAPTIVE_TIMEOUT_FACTOR,
+        help=f"adaptive timeout = p99 latency x factor (default: {ADAPTIVE_TIMEOUT_FACTOR})"
+    )
+    parser.add_argument(
+        "--anomaly-detection", action="store_true",
+        help="report endpoints whose latency departs from their own baseline (EWMA/EWMV)"
+    )
+    parser.add_argument(
+        "--circuit-breaker", action="store_true",
+        help=f"skip endpoints after {BREAKER_THRESHOLD} failures in a row, "
+             "retrying them with exponential backoff"
+    )
+    parser.add_argument(
+        "--store", metavar="DB",
+        help="record every result in a SQLite history database"
+    )
+    parser.add_argument(
+        "--history", metavar="NAME",
+        help="print the stored history of an endpoint (needs --store) and exit"
+    )
+    parser.add_argument(
+        "--resolution", default="raw", choices=["raw"] + list(STORE_ROLLUPS),
+        help="--history resolution (default: raw)"
+    )
+    parser.add_argument(
+        "--since", type=float, default=3600,
+        help="--history window in seconds (default: 3600)"
+    )
+    parser.add_argument(
+        "--format", choices=["text", "ndjson"], default="text",
+        help="ndjson: also write each result as one JSON line when its probe finishes "
+             "(to stdout, replacing the console log, unless --output is given)"
+    )
+    parser.add_argument(
+        "--output", metavar="FILE",
+        help="--format ndjson: append the JSON lines to FILE instead of stdout"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, metavar="PORT",
+        help="serve Prometheus metrics on http://0.0.0.0:PORT/metrics"
+    )
+    parser.add_argument(
+        "--shard", metavar="INDEX/COUNT",
+        help="only probe shard INDEX of COUNT (e.g. 0/4), endpoints spread by consistent hashing"
+    )
+    parser.add_argument(
+        "--ring", metavar="IDS",
+        help="comma-separated monitor IDs sharing the endpoints on a consistent-hash ring "
+             "(with --monitor-id)"
+    )
+    parser.add_argument(
+        "--monitor-id", metavar="ID",
+        help="this monitor's ID on the --ring"
+    )
+    parser.add_argument(
+        "--summary-out", metavar="FILE",
+        help="write a mergeable JSON summary of the latest results after each run"
+    )
+    parser.add_argument(
+        "--merge", nargs="+", metavar="FILE",
+        help="merge --summary-out files from several monitors, print the result and exit"
+    )
+    parser.add_argument(
+        "--state", metavar="FILE",
+        help="warm start from this monitor state snapshot (latency baselines, breakers, "
+             f"last results, ETags) and keep it updated (every {STATE_SAVE_INTERVAL}s in "
+             "continuous mode)"
+    )
+    parser.add_argument(
+        "--config", metavar="FILE",
+        help="load endpoints from a JSON, YAML or TOML file (reloaded on change in continuous mode)"
+    )
+    return parser.parse_args(argv)
 
-        interval = int(sys.argv[2]) if len(sys.argv) > 2 else 60
-        continuous_monitoring(interval)
-        
+if __name__ == "__main__":
+    args = parse_args()
+    DEFAULT_ENGINE = args.engine
+    ADAPTIVE_TIMEOUTS = args.adaptive_timeout
+    ADAPTIVE_TIMEOUT_FACTOR = args.adaptive_factor
+    CIRCUIT_BREAKER = args.circuit_breaker
+    ANOMALY_DETECTION = args.anomaly_detection
+    DNS_CACHE_TTL = args.dns_ttl
+    if args.store:
+        store = ResultStore(args.store)
+        atexit.register(store.close)
+        if args.history:
+            for row in store.query(args.history, start=time.time() - args.since,
+                                   resolution=args.resolution):
+                print(json.dumps(row))
+            sys.exit(0)
+        RESULT_LISTENERS.append(store.add)
+    
+    if args.metrics_port:
+        metrics = MetricsRegistry()
+        RESULT_LISTENERS.append(metrics.observe)
+        REMOVAL_LISTENERS.append(metrics.remove)
+        start_metrics_server(metrics, args.metrics_port)
+    
+    if args.merge:
+        summaries = []
+        for path in args.merge:
+            with open(path) as f:
+                summaries.append(json.load(f))
+        print(json.dumps(merge_summaries(summaries), indent=2))
+        sys.exit(0)
+    
+    shard = None
+    try:
+        if args.ring:
+            shard = Shard(ring=HashRing(args.ring.split(',')), monitor_id=args.monitor_id)
+        elif args.shard:
+            shard = Shard.parse(args.shard)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    
+    console = not args.quiet
+    if args.format == "ndjson":
+        ndjson = NdjsonWriter(args.output)
+        atexit.register(ndjson.close)
+        RESULT_LISTENERS.append(ndjson.write)
+        EVENT_LISTENERS.append(ndjson.write)
+        if not args.output:
+            console = False  # stdout carries the JSON lines
+    
+    if args.per_host is None:
+        args.per_host = ASYNC_PER_HOST if args.use_async else PER_HOST
+    
+    configure_logging(buffered=args.buffered_log, console=console)
+    if args.state:
+        load_state(args.state)
+        # docker stop sends SIGTERM: exit through the finally blocks that save the state
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if args.continuous is not None:
+        continuous_monitoring(
+            args.continuous, args.workers,
+            pool_size=args.pool_size,
+            pool_idle_timeout=args.pool_idle_timeout,
+            jitter=args.jitter,
+            config_path=args.config,
+            use_async=args.use_async,
+            concurrency=args.concurrency,
+            per_host=args.per_host,
+            shard=shard,
+            summary_path=args.summary_out,
+            processes=args.processes,
+            process_threads=args.process_threads,
+            state_path=args.state
+        )
     else:
-        run_health_checks()
\ No newline at end of file
+        endpoints = load_endpoints(args.config) if args.config else ENDPOINTS
+        if shard is not None:
+            endpoints = shard.select(endpoints)
+            log_message(f"Shard {shard}: {len(endpoints)} endpoints")
+        if args.use_async:
+            import asyncio
+            results = asyncio.run(async_run_health_checks(endpoints, args.concurrency, args.per_host))
+        elif args.processes:
+            pool = ProcessProbePool(args.processes, args.process_threads, args.pool_size)
+            try:
+                results = run_health_checks(endpoints, pool=pool, per_host=args.per_host)
+            finally:
+                pool.close()
+        else:
+            results = run_health_checks(endpoints, max_workers=args.workers, per_host=args.per_host)
+        if args.summary_out:
+            write_summary(summarize(results, shard), args.summary_out)
+        if args.state:
+            save_state(args.state)
\ No newline at end of file
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Health Check Log Analytics
+uptime, MTTR, failure breakdown and latency percentiles per endpoint from
+health_check.log files (plain or gzip rotated)
+"""
+
+import argparse
+import calendar
+import gzip
+import json
+import math
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 64 * 1024 * 1024  # plain files larger than this are split across --jobs
+HISTOGRAM_PRECISION = 0.01  # relative error of the latency percentiles
+
+# ✓/✗ lines written by health_check.py, e.g.
+# [2025-12-12 01:33:52] [INFO] ✓ Library API - Health - Status: 200 - Response time: 12.3ms
+# [2025-12-12 01:33:58] [WARNING] ✗ Test Error - Expected 200, got 500
+CHECK_LINE = re.compile(
+    r'\[(\d{4}-\d\d-\d\d) (\d\d):(\d\d):(\d\d)\] \[\w+\] '
+    r'(?:✓ (.+) - Status: \S+ - Response time: ([\d.]+)ms'
+    r'|✗ (.+?) - (Timeout|Expected|Connection refused|Body mismatch|Error))'
+    .encode('utf-8')
+)
+FAILURE_KINDS = {
+    b"Timeout": "timeout",
+    b"Expected": "status",
+    b"Connection refused": "connection",
+    b"Body mismatch": "body",
+    b"Error": "error",
+}
+
+class LatencyHistogram:
+    """
+    Log-scale latency histogram: constant memory, mergeable, percentiles
+    within HISTOGRAM_PRECISION of the exact value
+    """
+
+    _log_base = math.log1p(2 * HISTOGRAM_PRECISION)
+    _zero = -2 ** 31  # bucket of 0ms
+
+    def __init__(self):
+        self.counts = {}  # bucket -> count
+        self.total = 0
+
+    def add(self, ms):
+        bucket = math.floor(math.log(ms) / self._log_base) if ms > 0 else self._zero
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+
+    def percentile(self, pct):
+        """Nearest-rank percentile (ms, middle of its bucket), None when empty"""
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(pct / 100 * self.total))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                if bucket == self._zero:
+                    return 0.0
+                return round(math.exp((bucket + 0.5) * self._log_base), 2)
+
+class EndpointHistory:
+    """
+    Running totals for one endpoint over a time-ordered stretch of log lines
+    Histories of consecutive stretches merge, so files (or parts of a file)
+    can be read in parallel. Outages already in progress at the start of the
+    logs are not counted in MTTR, outages still open at the end are reported
+    as down_since.
+    """
+
+    def __init__(self):
+        self.checks = 0
+        self.successes = 0
+        self.failures = {kind: 0 for kind in FAILURE_KINDS.values()}
+        self.latency = LatencyHistogram()
+        self.first_ts = None
+        self.last_ts = None
+        self.head_failed = False  # the stretch starts with failures...
+        self.head_recovery = None  # ...that ended at this time
+        self.down_since = None  # start of the failure run still open
+        self.incidents = 0
+        self.repair_seconds = 0
+
+    def add(self, ts, ok, ms=None, kind=None):
+        self.checks += 1
+        if self.first_ts is None:
+            self.first_ts = ts
+            self.head_failed = not ok
+        self.last_ts = ts
+        if ok:
+            self.successes += 1
+            self.latency.add(ms)
+            if self.down_since is not None:
+                if self.head_failed and self.head_recovery is None:
+                    self.head_recovery = ts
+                else:
+                    self._repaired(ts - self.down_since)
+                self.down_since = None
+        else:
+            self.failures[kind] += 1
+            if self.down_since is None:
+                self.down_since = ts
+
+    def _repaired(self, seconds):
+        self.incidents += 1
+        self.repair_seconds += seconds
+
+    def merge(self, later):
+        """Append the history of the stretch that follows this one"""
+        if not later.checks:
+            return
+        if not self.checks:
+            self.__dict__.update(later.__dict__)
+            return
+
+        self.checks += later.checks
+        self.successes += later.successes
+        for kind, count in later.failures.items():
+            self.failures[kind] += count
+        self.latency.merge(later.latency)
+        self.incidents += later.incidents
+        self.repair_seconds += later.repair_seconds
+
+        # The outage open at the end of this stretch ends with the first
+        # success of the next one
+        head_open = self.head_failed and self.head_recovery is None
+        if self.down_since is not None:
+            recovered = later.head_recovery if later.head_failed else later.first_ts
+            if recovered is not None:
+                if head_open:
+                    self.head_recovery = recovered
+                else:
+                    self._repaired(recovered - self.down_since)
+        elif later.head_failed and later.head_recovery is not None:
+            self._repaired(later.head_recovery - later.first_ts)
+
+        if later.down_since is not None and later.head_recovery is None and later.head_failed:
+            # the next stretch only failed, the outage goes on
+            if self.down_since is None:
+                self.down_since = later.first_ts
+        else:
+            self.down_since = later.down_since
+        self.last_ts = later.last_ts
+
+    def report(self):
+        """Dictionary of uptime %, MTTR, failure counts and latency percentiles"""
+        return {
+            "checks": self.checks,
+            "uptime_pct": round(self.successes / self.checks * 100, 3) if self.checks else None,
+            "incidents": self.incidents,
+            "mttr_s": round(self.repair_seconds / self.incidents, 1) if self.incidents else None,
+            "down_since": _format_ts(self.down_since),
+            "failures": dict(self.failures),
+            "p50_ms": self.latency.percentile(50),
+            "p95_ms": self.latency.percentile(95),
+            "p99_ms": self.latency.percentile(99),
+        }
+
+def _format_ts(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts)) if ts is not None else None
+
+def _open(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+def parse_lines(lines, histories=None):
+    """
+    Feed ✓/✗ log lines (bytes) into per-endpoint histories
+    Returns: (histories, number of lines read)
+    """
+    if histories is None:
+        histories = {}
+    days = {}  # "YYYY-mm-dd" -> epoch seconds, timestamps are parsed once a day
+    match = CHECK_LINE.match
+    count = 0
+    for line in lines:
+        count += 1
+        m = match(line)
+        if m is None:
+            continue
+        date, hh, mm, ss, ok_name, ms, fail_name, kind = m.groups()
+        day = days.get(date)
+        if day is None:
+            day = days[date] = calendar.timegm(time.strptime(date.decode(), "%Y-%m-%d"))
+        ts = day + int(hh) * 3600 + int(mm) * 60 + int(ss)
+
+        name = (ok_name or fail_name).decode('utf-8', 'replace')
+        history = histories.get(name)
+        if history is None:
+            history = histories[name] = EndpointHistory()
+        if ok_name is not None:
+            history.add(ts, True, float(ms))
+        else:
+            history.add(ts, False, kind=FAILURE_KINDS[kind])
+    return histories, count
+
+def _read_range(path, start, end):
+    """Lines of a plain file that start within [start, end)"""
+    with open(path, 'rb') as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()  # finish the line the previous range owns
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+def analyze_part(part):
+    """Parse one (path, start, end) part, end None meaning the whole file"""
+    path, start, end = part
+    if end is None:
+        with _open(path) as f:
+            return parse_lines(f)
+    return parse_lines(_read_range(path, start, end))
+
+def _first_timestamp(path):
+    """First check line timestamp of a file, to read files oldest first"""
+    with _open(path) as f:
+        for line in f:
+            m = CHECK_LINE.match(line)
+            if m is not None:
+                return m.group(1, 2, 3, 4)
+    return ()
+
+def split_files(paths, chunk_size=CHUNK_SIZE):
+    """
+    Parts to read, oldest file first: plain files larger than chunk_size are
+    split into line-aligned byte ranges, gzip files are read whole
+    """
+    parts = []
+    for path in sorted(paths, key=_first_timestamp):
+        size = os.path.getsize(path)
+        if path.endswith('.gz') or size <= chunk_size:
+            parts.append((path, 0, None))
+        else:
+            parts += [(path, start, min(start + chunk_size, size))
+                      for start in range(0, size, chunk_size)]
+    return parts
+
+def analyze(paths, jobs=1, chunk_size=CHUNK_SIZE):
+    """
+    Analyze health check logs
+    Args:
+        paths: log files, plain or .gz
+        jobs: worker processes reading parts in parallel
+        chunk_size: bytes per part of a large plain file
+    Returns: (histories by endpoint name, lines read)
+    """
+    parts = split_files(paths, chunk_size)
+    if jobs > 1 and len(parts) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            partials = list(executor.map(analyze_part, parts))
+    else:
+        partials = map(analyze_part, parts)
+
+    histories, total = {}, 0
+    for partial, count in partials:
+        total += count
+        for name, history in partial.items():
+            histories.setdefault(name, EndpointHistory()).merge(history)
+    return histories, total
+
+def format_report(histories):
+    """Text table of the endpoint reports"""
+    lines = [
+        f"{'Endpoint':<32} {'Checks':>8} {'Uptime':>9} {'Incid.':>6} {'MTTR':>9} "
+        f"{'Timeout':>7} {'Status':>6} {'Refused':>7} {'Other':>6} "
+        f"{'p50':>10} {'p95':>10} {'p99':>10}"
+    ]
+    for name in sorted(histories):
+        r = histories[name].report()
+        f = r['failures']
+        mttr = f"{r['mttr_s']:.0f}s" if r['mttr_s'] is not None else "-"
+        lines.append(
+            f"{name[:32]:<32} {r['checks']:>8} {r['uptime_pct']:>8.2f}% {r['incidents']:>6} {mttr:>9} "
+            f"{f['timeout']:>7} {f['status']:>6} {f['connection']:>7} {f['body'] + f['error']:>6} "
+            + " ".join(f"{v:>8.2f}ms" if v is not None else f"{'-':>10}"
+                       for v in (r['p50_ms'], r['p95_ms'], r['p99_ms']))
+        )
+        if r['down_since']:
+            lines.append(f"  down since {r['down_since']}")
+    return "\n".join(lines)
+
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Health Check Log Analytics")
+    parser.add_argument("paths", nargs="+", metavar="LOG",
+                        help="health_check.log files, plain or .gz")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="worker processes (default: 1, 0 for one per core)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE // (1024 * 1024),
+                        help="MiB per part when splitting large plain files (default: 64)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    start = time.perf_counter()
+    histories, lines = analyze(args.paths, args.jobs or os.cpu_count() or 1,
+                               args.chunk_size * 1024 * 1024)
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps({name: h.report() for name, h in sorted(histories.items())}, indent=2))
+    else:
+        print(format_report(histories))
+    print(f"Read {lines} lines in {elapsed:.2f}s ({lines / elapsed if elapsed else 0:,.0f} lines/sec)",
+          file=sys.stderr)
@@ -0,0 +1,58 @@
+import sys
+import os
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.benchmark_health_check import (
+    StubServer, make_endpoints, bench_async, measure_isolated, resource, compare
+)
+
+
+def test_stub_server_errors_and_body_size():
+    """the stub server answers with the configured error rate and body size"""
+    server = StubServer(error_rate=0.5, body_size=1024, seed=1)
+    endpoints = make_endpoints(server.start(), 200, timeout=5)
+    try:
+        outcome = bench_async(endpoints, 1, 50, 10)
+    finally:
+        server.stop()
+
+    assert outcome["probes"] == 200
+    assert 60 < outcome["failures"] < 140
+    assert server.requests == 200
+    assert len(server._ok) > 1024
+
+
+def test_compare_flags_regressions():
+    """slower probing or more CPU per probe beyond the tolerance is a regression"""
+    baseline = {"results": {
+        "run/100": {"probes_per_sec": 500.0, "cpu_ms_per_probe": 1.0, "peak_rss_mb": 40.0},
+    }}
+    results = {
+        "run/100": {"probes_per_sec": 450.0, "cpu_ms_per_probe": 1.5, "peak_rss_mb": 41.0},
+        "run/1000": {"probes_per_sec": 10.0, "cpu_ms_per_probe": 9.0, "peak_rss_mb": 90.0},
+    }
+
+    regressions = compare(results, baseline, tolerance=0.2)
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith("run/100 cpu_ms_per_probe")
+
+
+def test_measure_isolated_runs_apart():
+    """each measurement runs in its own process, with its own peak RSS"""
+    server = StubServer(seed=1)
+    endpoints = make_endpoints(server.start(), 20, timeout=5)
+    try:
+        result = measure_isolated(bench_async, endpoints, 1, 10, 10)
+    finally:
+        server.stop()
+
+    assert result["probes"] == 20
+    assert result["failures"] == 0
+    assert server.requests == 20
+    assert result["cpu_s"] > 0
+    if resource is not None:
+        assert result["peak_rss_mb"] > 0
+        assert result["worker_rss_mb"] is None
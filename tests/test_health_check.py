@@ -1,11 +1,59 @@
 import sys
 import os
+import gzip
+import json
+import asyncio
+import subprocess
+import http.server
+import threading
+import tempfile
+import time
 import pytest
 from unittest.mock import Mock, patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from scripts.health_check import check_endpoint, ENDPOINTS
+from scripts.health_check import (
+    ENDPOINTS,
+    check_endpoint,
+    check_endpoints,
+    SessionPool,
+    EndpointScheduler,
+    BufferedLogWriter,
+    load_endpoints,
+    EndpointConfigWatcher,
+    apply_config_changes,
+    LatencyStats,
+    percentile,
+    ResultStore,
+    TIMING_PHASES,
+    MetricsRegistry,
+    start_metrics_server,
+    scan_body,
+    effective_timeout,
+    get_stats,
+    record_result,
+    server_cpu_ms,
+    DnsCache,
+    ProbeDispatcher,
+    save_state,
+    load_state,
+    get_breaker,
+    get_detector,
+    CircuitBreaker,
+    AsyncConnectionPool,
+    async_run_health_checks,
+    Shard,
+    HashRing,
+    summarize,
+    merge_summaries,
+    ProcessProbePool,
+    run_health_checks,
+    NdjsonWriter,
+    RESULT_LISTENERS,
+    AnomalyDetector,
+    EVENT_LISTENERS,
+)
 
 @patch('scripts.health_check.requests.get')
 def test_check_endpoint_success(mock_get):
@@ -14,6 +62,8 @@ def test_check_endpoint_success(mock_get):
 
     mock_response = Mock()
     mock_response.status_code = 200
+    mock_response.raw.stream.return_value = []
+    mock_response.headers = {}
     mock_get.return_value = mock_response
     endpoint = {
         "name": "Test API",
@@ -34,6 +84,8 @@ def test_check_endpoint_wrong_status(mock_get):
     """endpoint test wrong status code"""
     mock_response = Mock()
     mock_response.status_code = 500
+    mock_response.raw.stream.return_value = []
+    mock_response.headers = {}
     mock_get.return_value = mock_response
     endpoint = {
         "name": "Test Error",
@@ -93,4 +145,1375 @@ def test_endpoints_configuration():
         assert "url" in endpoint
         assert "expected_status" in endpoint
         assert "timeout" in endpoint
-        assert endpoint["url"].startswith("http")
\ No newline at end of file
+        assert endpoint["url"].startswith("http")
+
+@patch('scripts.health_check.requests.get')
+def test_check_endpoints_concurrent(mock_get):
+    """concurrent checks take about as long as the slowest endpoint"""
+
+    def slow_get(url, timeout, stream):
+        time.sleep(0.3)
+        response = Mock()
+        response.status_code = 200
+        response.raw.stream.return_value = []
+        response.headers = {}
+        return response
+
+    mock_get.side_effect = slow_get
+    endpoints = [
+        {
+            "name": f"Endpoint {i}",
+            "url": f"http://test.com/{i}",
+            "expected_status": 200,
+            "timeout": 5
+        }
+        for i in range(5)
+    ]
+
+    start = time.time()
+    results = check_endpoints(endpoints, max_workers=5)
+    elapsed = time.time() - start
+
+    assert elapsed < 1.0
+    assert [r["name"] for r in results] == [e["name"] for e in endpoints]
+    assert all(r["success"] for r in results)
+
+
+def test_session_pool_reuses_session_per_host():
+    """one session per host, kept across calls"""
+    pool = SessionPool(pool_size=4, idle_timeout=300)
+    try:
+        first = pool.get("http://test.com/a")
+        second = pool.get("http://test.com/b")
+        other = pool.get("http://other.com/")
+
+        assert first is second
+        assert first is not other
+        assert len(pool) == 2
+    finally:
+        pool.close()
+
+
+def test_session_pool_evicts_idle_sessions():
+    """sessions unused for longer than idle_timeout are closed"""
+    pool = SessionPool(pool_size=4, idle_timeout=0)
+    session = pool.get("http://test.com/")
+
+    with patch.object(session, 'close') as mock_close:
+        assert pool.evict_idle() == 1
+        mock_close.assert_called_once()
+    assert len(pool) == 0
+
+
+def test_check_endpoint_uses_session():
+    """check_endpoint goes through the given session"""
+    session = Mock()
+    session.get.return_value.status_code = 200
+    session.get.return_value.raw.stream.return_value = []
+    session.get.return_value.headers = {}
+    endpoint = {
+        "name": "Pooled",
+        "url": "http://test.com/",
+        "expected_status": 200,
+        "timeout": 5
+    }
+
+    result = check_endpoint(endpoint, session)
+
+    assert result["success"] == True
+    session.get.assert_called_once_with("http://test.com/", timeout=5, stream=True)
+
+
+def test_scheduler_per_endpoint_intervals():
+    """each endpoint fires on its own fixed deadlines"""
+    now = [0.0]
+    scheduler = EndpointScheduler(default_interval=30, clock=lambda: now[0])
+    fast = {"name": "fast", "url": "http://test.com/fast", "interval": 10}
+    slow = {"name": "slow", "url": "http://test.com/slow"}
+    scheduler.add(fast)
+    scheduler.add(slow)
+
+    assert [e["name"] for e in scheduler.pop_due()] == ["fast", "slow"]
+    now[0] = 1.5  # checks took 1.5s, deadlines must not drift
+    assert scheduler.reschedule(fast) == 0
+    assert scheduler.reschedule(slow) == 0
+
+    now[0] = 10.0
+    assert [e["name"] for e in scheduler.pop_due()] == ["fast"]
+    scheduler.reschedule(fast)
+    assert scheduler.next_fire_time() == 20.0
+
+
+def test_scheduler_reports_overrun():
+    """a check running past its next deadlines skips them"""
+    now = [0.0]
+    scheduler = EndpointScheduler(default_interval=10, clock=lambda: now[0])
+    endpoint = {"name": "slow", "url": "http://test.com/slow"}
+    scheduler.add(endpoint)
+    scheduler.pop_due()
+
+    now[0] = 25.0
+    assert scheduler.reschedule(endpoint) == 2
+    assert scheduler.next_fire_time() == 30.0
+
+
+def test_scheduler_remove():
+    """removed endpoints are never returned again"""
+    scheduler = EndpointScheduler(default_interval=10, clock=lambda: 0.0)
+    scheduler.add({"name": "gone", "url": "http://test.com/"})
+    scheduler.remove("gone")
+
+    assert scheduler.pop_due() == []
+    assert scheduler.next_fire_time() is None
+
+
+def test_buffered_log_writer_batches_until_close():
+    """lines are held back until a threshold or close"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_path = os.path.join(temp_dir, "health_check.log")
+        writer = BufferedLogWriter(log_path, flush_bytes=1024 * 1024, flush_interval=60)
+
+        for i in range(100):
+            writer.write(f"line {i}\n")
+        time.sleep(0.1)
+        assert os.path.getsize(log_path) == 0
+
+        writer.close()
+        with open(log_path) as f:
+            lines = f.read().splitlines()
+        assert lines == [f"line {i}" for i in range(100)]
+
+
+def test_buffered_log_writer_flushes_on_size():
+    """reaching flush_bytes writes the pending batch"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_path = os.path.join(temp_dir, "health_check.log")
+        writer = BufferedLogWriter(log_path, flush_bytes=10, flush_interval=60)
+        try:
+            writer.write("0123456789\n")
+            for _ in range(50):
+                if os.path.getsize(log_path) > 0:
+                    break
+                time.sleep(0.02)
+            assert os.path.getsize(log_path) == 11
+        finally:
+            writer.close()
+
+
+def test_load_endpoints_json_defaults():
+    """config files fill in expected_status and timeout"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, "endpoints.json")
+        with open(config_path, 'w') as f:
+            json.dump({"endpoints": [
+                {"name": "Home", "url": "http://test.com/", "interval": 10,
+                 "headers": {"Authorization": "Bearer x"}}
+            ]}, f)
+
+        endpoints = load_endpoints(config_path)
+
+    assert endpoints == [{
+        "name": "Home",
+        "url": "http://test.com/",
+        "interval": 10,
+        "headers": {"Authorization": "Bearer x"},
+        "expected_status": 200,
+        "timeout": 5
+    }]
+
+
+def test_load_endpoints_toml():
+    """TOML config with an array of endpoint tables"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, "endpoints.toml")
+        with open(config_path, 'w') as f:
+            f.write('[[endpoints]]\nname = "Health"\nurl = "http://test.com/health"\ntimeout = 2\n')
+
+        endpoints = load_endpoints(config_path)
+
+    assert endpoints[0]["name"] == "Health"
+    assert endpoints[0]["timeout"] == 2
+
+
+def test_load_endpoints_rejects_duplicates():
+    """endpoint names identify state, so they must be unique"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, "endpoints.json")
+        with open(config_path, 'w') as f:
+            json.dump([{"name": "A", "url": "http://a"}, {"name": "A", "url": "http://b"}], f)
+
+        with pytest.raises(ValueError):
+            load_endpoints(config_path)
+
+
+def test_config_watcher_reports_incremental_changes():
+    """only added, removed and changed endpoints are reported"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, "endpoints.json")
+        with open(config_path, 'w') as f:
+            json.dump([
+                {"name": "keep", "url": "http://test.com/keep"},
+                {"name": "change", "url": "http://test.com/change"},
+                {"name": "drop", "url": "http://test.com/drop"}
+            ], f)
+        watcher = EndpointConfigWatcher(config_path)
+        assert watcher.poll() == ([], [], [])
+
+        with open(config_path, 'w') as f:
+            json.dump([
+                {"name": "keep", "url": "http://test.com/keep"},
+                {"name": "change", "url": "http://test.com/change", "timeout": 1},
+                {"name": "new", "url": "http://test.com/new"}
+            ], f)
+        os.utime(config_path, ns=(0, 0))
+
+        added, removed, changed = watcher.poll()
+
+    assert [e["name"] for e in added] == ["new"]
+    assert [e["name"] for e in removed] == ["drop"]
+    assert [e["name"] for e in changed] == ["change"]
+
+
+def test_config_reload_removes_metrics():
+    """endpoints dropped from the config stop being exported"""
+    from scripts import health_check
+    registry = MetricsRegistry()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, "endpoints.json")
+        with open(config_path, 'w') as f:
+            json.dump([
+                {"name": "keep", "url": "http://test.com/keep"},
+                {"name": "drop", "url": "http://test.com/drop"}
+            ], f)
+        watcher = EndpointConfigWatcher(config_path)
+        scheduler = EndpointScheduler()
+        for endpoint in watcher.endpoints.values():
+            scheduler.add(endpoint)
+            registry.observe({"name": endpoint["name"], "url": endpoint["url"], "success": False,
+                              "error": "Connection refused", "timestamp": "t"})
+
+        with open(config_path, 'w') as f:
+            json.dump([{"name": "keep", "url": "http://test.com/keep"}], f)
+        os.utime(config_path, ns=(0, 0))
+        with patch.object(health_check, 'REMOVAL_LISTENERS', [registry.remove]):
+            apply_config_changes(scheduler, watcher)
+
+    output = registry.render()
+    assert 'endpoint="keep"' in output
+    assert 'endpoint="drop"' not in output
+
+
+def test_config_reload_forgets_endpoint_state():
+    """endpoints dropped from the config leave no per-endpoint state behind"""
+    from scripts import health_check
+    names = ("Reload keep", "Reload drop")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, "endpoints.json")
+        with open(config_path, 'w') as f:
+            json.dump([{"name": name, "url": "http://test.com/"} for name in names], f)
+        watcher = EndpointConfigWatcher(config_path)
+        scheduler = EndpointScheduler()
+        for endpoint in watcher.endpoints.values():
+            scheduler.add(endpoint)
+            record_result({"name": endpoint["name"], "url": endpoint["url"], "success": True,
+                           "response_time_ms": 12.0, "timestamp": "t"})
+            get_detector(endpoint["name"])
+            get_breaker(endpoint["name"])
+
+        with open(config_path, 'w') as f:
+            json.dump([{"name": "Reload keep", "url": "http://test.com/"}], f)
+        os.utime(config_path, ns=(0, 0))
+        try:
+            apply_config_changes(scheduler, watcher)
+
+            for registry in (health_check.LATENCY_STATS, health_check.DETECTORS,
+                             health_check.BREAKERS, health_check.LAST_RESULTS):
+                assert "Reload keep" in registry
+                assert "Reload drop" not in registry
+            assert "Reload drop" not in json.dumps(health_check.snapshot_state())
+        finally:
+            health_check.forget_endpoint("Reload keep")
+
+
+def test_percentile_nearest_rank():
+    """nearest-rank percentiles"""
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) is None
+
+
+def test_latency_stats_rolling_window():
+    """only the most recent `window` checks are kept"""
+    stats = LatencyStats(window=10)
+    for ms in range(100):
+        stats.add(True, float(ms))
+    stats.add(False)
+
+    summary = stats.summary()
+
+    assert summary["checks"] == 10
+    assert summary["min"] == 91.0
+    assert summary["max"] == 99.0
+    assert summary["success_ratio"] == 0.9
+    assert stats.summary(last=1)["success_ratio"] == 0.0
+
+
+def _recent_hour():
+    """Start of the hour three hours ago, well inside the raw retention"""
+    from datetime import datetime, timedelta
+    return (datetime.now() - timedelta(hours=3)).replace(minute=0, second=0, microsecond=0)
+
+
+def _stored_result(name, timestamp, success=True, response_time_ms=10.0):
+    result = {
+        "name": name,
+        "url": "http://test.com/",
+        "success": success,
+        "timestamp": timestamp.isoformat()
+    }
+    if success:
+        result["status_code"] = 200
+        result["response_time_ms"] = response_time_ms
+    else:
+        result["error"] = "Timeout"
+    return result
+
+
+def test_result_store_range_query():
+    """results are queried per endpoint and time range"""
+    base = _recent_hour()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = ResultStore(os.path.join(temp_dir, "history.db"))
+        try:
+            for minute in range(5):
+                store.add(_stored_result("a", base.replace(minute=minute)))
+                store.add(_stored_result("b", base.replace(minute=minute), success=False))
+
+            start = base.replace(minute=1).timestamp()
+            end = base.replace(minute=3).timestamp()
+            rows = store.query("a", start, end)
+            failures = store.query("b")
+        finally:
+            store.close()
+
+    assert [r["ts"] for r in rows] == [start, base.replace(minute=2).timestamp()]
+    assert all(r["status_code"] == 200 for r in rows)
+    assert len(failures) == 5
+    assert failures[0]["error"] == "Timeout"
+    assert failures[0]["success"] == False
+
+
+def test_result_store_rollups():
+    """completed buckets are aggregated per resolution"""
+    base = _recent_hour()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = ResultStore(os.path.join(temp_dir, "history.db"))
+        try:
+            store.add(_stored_result("a", base.replace(second=10), response_time_ms=10.0))
+            store.add(_stored_result("a", base.replace(second=20), response_time_ms=30.0))
+            store.add(_stored_result("a", base.replace(second=30), success=False))
+            store.rollup(now=base.timestamp() + 90)
+
+            minute = store.query("a", resolution="1m")
+            hour = store.query("a", resolution="1h")
+        finally:
+            store.close()
+
+    assert minute == [{
+        "ts": int(base.timestamp()),
+        "checks": 3,
+        "failures": 1,
+        "avg_ms": 20.0,
+        "min_ms": 10.0,
+        "max_ms": 30.0
+    }]
+    assert hour == []  # the hour bucket is not complete yet
+
+
+GZIP_BODY = gzip.compress(b'{"status": "healthy"}' * 100)
+
+
+class _StubHandler(http.server.BaseHTTPRequestHandler):
+    """Minimal local target for stdlib probe tests"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/api/catalog":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("ETag", '"v1"')
+                self.end_headers()
+                return
+            self._send(200, b'{"books": []}', {"ETag": '"v1"', "Server-Timing": "db;dur=2, cpu;dur=1.5"})
+            return
+        if self.path == "/gzip":
+            self._send(200, GZIP_BODY, {"Content-Encoding": "gzip"})
+            return
+        if self.path.startswith("/api/books/"):
+            status = 200 if self.path == "/api/books/7" else 404
+            self._send(status, json.dumps({"id": 7, "title": "Stub"}).encode())
+            return
+        self._send(200, b'{"status": "healthy"}')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self._send(201, json.dumps({"id": 7, "title": "Stub"}).encode())
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "21")
+        self.end_headers()
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_check_endpoint_timed_engine(stub_server):
+    """the timed engine reports each phase of the request"""
+    endpoint = {
+        "name": "Timed",
+        "url": f"{stub_server}/health",
+        "expected_status": 200,
+        "timeout": 5,
+        "engine": "timed"
+    }
+
+    result = check_endpoint(endpoint)
+
+    assert result["success"] == True
+    assert set(result["timings"]) == set(TIMING_PHASES)
+    assert result["timings"]["tls_ms"] == 0
+    assert sum(result["timings"].values()) == pytest.approx(result["response_time_ms"], abs=0.1)
+
+
+@pytest.mark.parametrize("engine", ["requests", "http"])
+def test_body_bytes_on_the_wire(stub_server, engine):
+    """every engine reports the body size as sent, before decompression"""
+    endpoint = {
+        "name": "Compressed",
+        "url": f"{stub_server}/gzip",
+        "expected_status": 200,
+        "timeout": 5,
+        "engine": engine
+    }
+
+    result = check_endpoint(endpoint)
+
+    assert result["success"] == True
+    assert result["body_bytes"] == len(GZIP_BODY)
+
+
+def test_check_endpoint_timed_engine_connection_refused():
+    """stdlib connection errors map to the usual error"""
+    endpoint = {
+        "name": "Closed",
+        "url": "http://127.0.0.1:1/",
+        "expected_status": 200,
+        "timeout": 2,
+        "engine": "timed"
+    }
+
+    result = check_endpoint(endpoint)
+
+    assert result["success"] == False
+    assert result["error"] == "Connection refused"
+
+
+def test_latency_stats_phase_percentiles():
+    """timing phases are summarised alongside the total"""
+    stats = LatencyStats(window=10)
+    stats.add(True, 30.0, {"dns_ms": 1.0, "connect_ms": 2.0, "tls_ms": 0.0, "ttfb_ms": 25.0, "body_ms": 2.0})
+    stats.add(True, 10.0)
+
+    phases = stats.summary()["phases"]
+
+    assert phases["ttfb_ms"]["p50"] == 25.0
+    assert set(phases) == set(TIMING_PHASES)
+
+
+def test_metrics_registry_render():
+    """results are exposed as Prometheus gauges, counters and histograms"""
+    registry = MetricsRegistry(buckets=(0.01, 0.1))
+    registry.observe({"name": "API", "url": "http://test.com/", "success": True,
+                      "status_code": 200, "response_time_ms": 50.0})
+    registry.observe({"name": "API", "url": "http://test.com/", "success": False,
+                      "error": "Timeout"})
+
+    text = registry.render()
+
+    labels = 'endpoint="API",url="http://test.com/"'
+    assert f"health_check_up{{{labels}}} 0" in text
+    assert f"health_check_checks_total{{{labels}}} 2" in text
+    assert f'health_check_errors_total{{{labels},kind="timeout"}} 1' in text
+    assert f'health_check_response_time_seconds_bucket{{{labels},le="0.01"}} 0' in text
+    assert f'health_check_response_time_seconds_bucket{{{labels},le="0.1"}} 1' in text
+    assert f'health_check_response_time_seconds_bucket{{{labels},le="+Inf"}} 1' in text
+    assert f"health_check_response_time_seconds_count{{{labels}}} 1" in text
+
+
+def test_metrics_server_serves_registry():
+    """the embedded server answers scrapes on /metrics"""
+    import urllib.request
+    registry = MetricsRegistry()
+    registry.observe({"name": "API", "url": "http://test.com/", "success": True,
+                      "status_code": 200, "response_time_ms": 5.0})
+    server = start_metrics_server(registry, 0, host="127.0.0.1")
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 'health_check_up{endpoint="API",url="http://test.com/"} 1' in body
+
+
+def test_scan_body_stops_at_marker_across_chunks():
+    """the marker is found across chunk boundaries without reading further"""
+    chunks = iter([b'{"stat', b'us": "heal', b'thy"}', b"never read"])
+
+    found, read = scan_body(chunks, '"status": "healthy"')
+
+    assert found == True
+    assert read == len(b'{"status": "healthy"}')
+    assert next(chunks) == b"never read"
+
+
+def test_scan_body_respects_byte_cap():
+    """no more than max_bytes are read when the marker is missing"""
+    chunks = (b"x" * 1000 for _ in range(100))
+
+    found, read = scan_body(chunks, "healthy", max_bytes=2500)
+
+    assert found == False
+    assert read == 2500
+
+
+def test_check_endpoint_body_assertion_fails():
+    """a missing marker fails the check even with the right status"""
+    session = Mock()
+    response = session.get.return_value
+    response.status_code = 200
+    response.headers = {}
+    response.iter_content.return_value = iter([b'{"status": "degraded"}'])
+    endpoint = {
+        "name": "Body",
+        "url": "http://test.com/health",
+        "expected_status": 200,
+        "timeout": 5,
+        "body_contains": '"status": "healthy"'
+    }
+
+    result = check_endpoint(endpoint, session)
+
+    assert result["success"] == False
+    assert result["body_match"] == False
+    assert result["error"] == "Body mismatch"
+    assert session.get.call_args.kwargs["stream"] == True
+    response.close.assert_called_once()
+
+
+def test_effective_timeout_adapts_to_latency():
+    """p99 x factor, clamped to the configured timeout"""
+    endpoint = {
+        "name": "Adaptive fast",
+        "url": "http://test.com/fast",
+        "expected_status": 200,
+        "timeout": 5,
+        "adaptive_timeout": True
+    }
+    assert effective_timeout(endpoint) == 5  # not enough samples yet
+
+    stats = get_stats("Adaptive fast")
+    for _ in range(50):
+        stats.add(True, 100.0)
+    assert effective_timeout(endpoint) == 0.3
+
+    assert effective_timeout(dict(endpoint, adaptive_timeout=False)) == 5
+    assert effective_timeout(dict(endpoint, adaptive_factor=100)) == 5
+
+
+def test_effective_timeout_relearns_after_timeouts():
+    """repeated adaptive timeouts fall back to one full-timeout check"""
+    endpoint = {
+        "name": "Adaptive slowed",
+        "url": "http://test.com/slowed",
+        "expected_status": 200,
+        "timeout": 5,
+        "adaptive_timeout": True
+    }
+    stats = get_stats("Adaptive slowed")
+    for _ in range(50):
+        stats.add(True, 100.0)
+
+    for _ in range(5):
+        assert effective_timeout(endpoint) == 0.3
+        record_result({"name": "Adaptive slowed", "url": endpoint["url"], "success": False,
+                       "error": "Timeout", "adaptive_timeout": 0.3})
+
+    assert effective_timeout(endpoint) == 5
+    assert effective_timeout(endpoint) == 0.3
+
+
+@patch('scripts.health_check.requests.get')
+def test_check_endpoint_uses_adaptive_timeout(mock_get):
+    """the adaptive deadline is passed to the probe and reported"""
+    mock_get.return_value.status_code = 200
+    stats = get_stats("Adaptive probe")
+    for _ in range(50):
+        stats.add(True, 200.0)
+    endpoint = {
+        "name": "Adaptive probe",
+        "url": "http://test.com/probe",
+        "expected_status": 200,
+        "timeout": 5,
+        "adaptive_timeout": True
+    }
+
+    result = check_endpoint(endpoint)
+
+    assert mock_get.call_args.kwargs["timeout"] == 0.6
+    assert result["adaptive_timeout"] == 0.6
+
+
+def test_circuit_breaker_backoff():
+    """opens after the threshold, half-opens after a doubling delay"""
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=3, base_delay=10, max_delay=25, clock=lambda: now[0])
+
+    assert breaker.record(False) is None
+    assert breaker.record(False) is None
+    assert breaker.record(False) == "opened"
+    assert breaker.allow() == False
+    assert breaker.retry_in() == 10
+
+    now[0] = 10.0
+    assert breaker.allow() == True  # half-open trial
+    assert breaker.allow() == False  # only one trial
+    assert breaker.record(False) == "opened"
+    assert breaker.retry_in() == 20
+
+    now[0] = 30.0
+    assert breaker.allow() == True
+    assert breaker.record(False) == "opened"
+    assert breaker.retry_in() == 25  # capped at max_delay
+
+    now[0] = 55.0
+    assert breaker.allow() == True
+    assert breaker.record(True) == "closed"
+    assert breaker.state == "closed"
+    assert breaker.delay() == 10
+
+
+@patch('scripts.health_check.requests.get')
+def test_check_endpoints_skips_open_circuit(mock_get):
+    """an endpoint with an open circuit is not probed"""
+    import requests
+    mock_get.side_effect = requests.exceptions.ConnectionError()
+    endpoint = {
+        "name": "Dead target",
+        "url": "http://test.com/dead",
+        "expected_status": 200,
+        "timeout": 5,
+        "circuit_breaker": True
+    }
+
+    for _ in range(5):
+        check_endpoints([endpoint])
+    assert mock_get.call_count == 5
+
+    results = check_endpoints([endpoint])
+
+    assert mock_get.call_count == 5
+    assert results[0]["skipped"] == True
+    assert results[0]["error"] == "Circuit open"
+
+
+@patch('scripts.health_check.requests.get')
+def test_check_endpoints_sequential_half_open_trial(mock_get):
+    """sequentially, an open circuit gets its half-open trial and closes on success"""
+    import requests
+    from scripts import health_check
+    now = [0.0]
+    health_check.BREAKERS["Revived target"] = CircuitBreaker(
+        threshold=2, base_delay=10, clock=lambda: now[0]
+    )
+    endpoint = {
+        "name": "Revived target",
+        "url": "http://test.com/revived",
+        "expected_status": 200,
+        "timeout": 5,
+        "circuit_breaker": True
+    }
+    try:
+        mock_get.side_effect = requests.exceptions.ConnectionError()
+        check_endpoints([endpoint], max_workers=1)
+        check_endpoints([endpoint], max_workers=1)
+        assert check_endpoints([endpoint], max_workers=1)[0]["skipped"] == True
+
+        mock_get.side_effect = None
+        mock_get.return_value = Mock(status_code=200, headers={}, **{'raw.stream.return_value': []})
+        now[0] = 10.0
+        results = check_endpoints([endpoint], max_workers=1)
+
+        assert results[0]["success"] == True
+        assert mock_get.call_count == 3
+        assert health_check.BREAKERS["Revived target"].state == "closed"
+    finally:
+        health_check.BREAKERS.pop("Revived target", None)
+
+
+@patch('scripts.health_check.requests.get')
+def test_check_endpoints_breaker_disabled(mock_get):
+    """with the breaker disabled, failures neither open it nor log about it"""
+    import requests
+    from scripts import health_check
+    health_check.BREAKERS["Breakerless"] = CircuitBreaker(threshold=2, base_delay=10)
+    endpoint = {
+        "name": "Breakerless",
+        "url": "http://test.com/breakerless",
+        "expected_status": 200,
+        "timeout": 5,
+        "circuit_breaker": False
+    }
+    mock_get.side_effect = requests.exceptions.ConnectionError()
+    try:
+        with patch('scripts.health_check.log_message') as mock_log:
+            for _ in range(3):
+                check_endpoints([endpoint], max_workers=1)
+
+        assert mock_get.call_count == 3
+        assert health_check.BREAKERS["Breakerless"].state == "closed"
+        assert health_check.BREAKERS["Breakerless"].failures == 0
+        assert not any("Circuit" in call.args[0] for call in mock_log.call_args_list)
+    finally:
+        health_check.BREAKERS.pop("Breakerless", None)
+
+
+def test_check_endpoint_tcp_engine(stub_server):
+    """the tcp engine only connects, no status code is involved"""
+    port = stub_server.rsplit(":", 1)[1]
+    endpoint = {
+        "name": "TCP",
+        "url": f"tcp://127.0.0.1:{port}",
+        "expected_status": 200,
+        "timeout": 5,
+        "engine": "tcp"
+    }
+
+    result = check_endpoint(endpoint)
+
+    assert result["success"] == True
+    assert result["status_code"] is None
+    assert set(result["timings"]) == {"dns_ms", "connect_ms", "tls_ms"}
+
+
+def test_check_endpoint_tcp_engine_needs_port():
+    """tcp:// urls must carry a port"""
+    endpoint = {
+        "name": "TCP no port",
+        "url": "tcp://127.0.0.1",
+        "expected_status": 200,
+        "timeout": 1,
+        "engine": "tcp"
+    }
+
+    result = check_endpoint(endpoint)
+
+    assert result["success"] == False
+    assert "No port" in result["error"]
+
+
+def test_async_run_health_checks_reuses_connections(stub_server):
+    """the asyncio pipeline returns the usual results over a few keep-alive connections"""
+    endpoints = [
+        {"name": f"Async {i}", "url": f"{stub_server}/health/{i}",
+         "expected_status": 200, "timeout": 5, "body_contains": "healthy"}
+        for i in range(20)
+    ]
+
+    async def run():
+        pool = AsyncConnectionPool(per_host=2)
+        try:
+            results = await async_run_health_checks(endpoints, per_host=2, pool=pool)
+            results += await async_run_health_checks(endpoints, per_host=2, pool=pool)
+        finally:
+            pool.close()
+        return results, pool
+
+    results, pool = asyncio.run(run())
+
+    assert [r["name"] for r in results] == [e["name"] for e in endpoints] * 2
+    assert all(r["success"] for r in results)
+    assert all(r["body_match"] for r in results)
+    assert pool.opened <= 2
+    assert pool.reused == 40 - pool.opened
+
+
+def test_async_run_health_checks_connection_refused():
+    """asyncio connection errors map to the usual error"""
+    endpoints = [{"name": "Async closed", "url": "http://127.0.0.1:1/",
+                  "expected_status": 200, "timeout": 2}]
+
+    results = asyncio.run(async_run_health_checks(endpoints))
+
+    assert results[0]["success"] == False
+    assert results[0]["error"] == "Connection refused"
+
+
+def test_shards_partition_endpoints_with_minimal_movement():
+    """every endpoint has one shard, and adding a shard only moves endpoints onto it"""
+    endpoints = [{"name": f"Shard {i}", "url": f"http://test.com/{i}"} for i in range(1000)]
+
+    three = [Shard(i, 3).select(endpoints) for i in range(3)]
+    four = {e["name"]: i for i in range(4) for e in Shard(i, 4).select(endpoints)}
+
+    assert sorted(e["name"] for part in three for e in part) == sorted(e["name"] for e in endpoints)
+    assert all(200 < len(part) < 467 for part in three)
+    moved = [e for i, part in enumerate(three) for e in part if four[e["name"]] != i]
+    assert all(four[e["name"]] == 3 for e in moved)
+    assert len(moved) < 350
+
+
+def test_hash_ring_moves_few_endpoints_when_monitor_joins():
+    """a new monitor on the ring only takes endpoints, nothing else moves"""
+    names = [f"Ring {i}" for i in range(1000)]
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+
+    moved = [n for n in names if before.owner(n) != after.owner(n)]
+
+    assert all(after.owner(n) == "d" for n in moved)
+    assert 100 < len(moved) < 400
+    with pytest.raises(ValueError):
+        Shard(ring=before, monitor_id="d")
+
+
+def test_merge_summaries_combines_shards():
+    """summaries of disjoint shards merge into one"""
+    first = summarize([
+        {"name": "Merge A", "url": "http://a/", "success": True, "status_code": 200,
+         "response_time_ms": 10.0, "timestamp": "2026-01-01T00:00:00"},
+    ], Shard(0, 2))
+    second = summarize([
+        {"name": "Merge B", "url": "http://b/", "success": False, "error": "Timeout",
+         "timestamp": "2026-01-01T00:00:01"},
+        {"name": "Merge C", "url": "http://c/", "success": False, "error": "Circuit open",
+         "skipped": True, "timestamp": "2026-01-01T00:00:01"},
+    ], Shard(1, 2))
+
+    merged = merge_summaries([first, second])
+
+    assert merged["shards"] == ["0/2", "1/2"]
+    assert (merged["total"], merged["passed"], merged["failed"], merged["skipped"]) == (2, 1, 1, 1)
+    assert merged["p50"] == 10.0
+    assert set(merged["endpoints"]) == {"Merge A", "Merge B", "Merge C"}
+
+
+def test_process_pool_streams_results_to_parent(stub_server):
+    """worker processes probe, the parent records results and keeps their order"""
+    endpoints = [
+        {"name": f"Process {i}", "url": f"{stub_server}/health/{i}",
+         "expected_status": 200 if i % 4 else 404, "timeout": 5, "engine": "http"}
+        for i in range(12)
+    ]
+    pool = ProcessProbePool(processes=2, threads=4)
+    try:
+        results = run_health_checks(endpoints, pool=pool)
+    finally:
+        pool.close()
+
+    assert [r["name"] for r in results] == [e["name"] for e in endpoints]
+    assert [r["success"] for r in results] == [bool(i % 4) for i in range(12)]
+    assert get_stats("Process 1").summary()["checks"] == 1
+
+
+def test_process_pool_per_host_limit():
+    """a host's checks all go to one worker process, which keeps to per_host"""
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    class SlowHandler(_StubHandler):
+        def do_GET(self):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            super().do_GET()
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoints = [
+        {"name": f"Per host {i}", "url": f"http://127.0.0.1:{server.server_address[1]}/health/{i}",
+         "expected_status": 200, "timeout": 5, "engine": "http"}
+        for i in range(12)
+    ]
+    pool = ProcessProbePool(processes=2, threads=8)
+    try:
+        results = run_health_checks(endpoints, pool=pool, per_host=2)
+    finally:
+        pool.close()
+        server.shutdown()
+        server.server_close()
+
+    assert all(r["success"] for r in results)
+    assert peak[0] == 2
+
+
+def test_transaction_steps_share_one_connection(stub_server):
+    """captured variables feed later steps, all on one keep-alive connection"""
+    endpoint = {
+        "name": "Transaction",
+        "url": stub_server,
+        "expected_status": 200,
+        "timeout": 5,
+        "engine": "transaction",
+        "steps": [
+            {"name": "add book", "method": "POST", "path": "/api/books",
+             "json": {"title": "Stub"}, "expected_status": 201, "capture": {"book_id": "id"}},
+            {"name": "fetch book", "path": "/api/books/${book_id}"},
+        ]
+    }
+
+    result = check_endpoint(endpoint)
+
+    assert result["success"] == True
+    assert result["connections"] == 1
+    assert [s["step"] for s in result["steps"]] == ["add book", "fetch book"]
+    assert [s["status_code"] for s in result["steps"]] == [201, 200]
+
+
+def test_transaction_reconnects_when_server_closes():
+    """a server without keep-alive (like the Flask dev server) costs a connection per step"""
+    class ClosingHandler(_StubHandler):
+        protocol_version = "HTTP/1.0"
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ClosingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = {
+        "name": "Transaction closing",
+        "url": f"http://127.0.0.1:{server.server_address[1]}",
+        "expected_status": 200,
+        "timeout": 5,
+        "engine": "transaction",
+        "steps": [
+            {"name": "add book", "method": "POST", "path": "/api/books",
+             "json": {"title": "Stub"}, "expected_status": 201, "capture": {"book_id": "id"}},
+            {"name": "fetch book", "path": "/api/books/${book_id}"},
+        ]
+    }
+    try:
+        result = check_endpoint(endpoint)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert result["success"] == True
+    assert result["connections"] == 2
+
+
+def test_transaction_stops_at_failed_step(stub_server):
+    """the first unexpected status ends the transaction and fails the check"""
+    endpoint = {
+        "name": "Transaction failing",
+        "url": stub_server,
+        "expected_status": 200,
+        "timeout": 5,
+        "engine": "transaction",
+        "steps": [
+            {"path": "/api/books/8"},
+            {"path": "/api/books/7"},
+        ]
+    }
+
+    result = check_endpoint(endpoint)
+
+    assert result["success"] == False
+    assert (result["status_code"], result["expected_status"]) == (404, 200)
+    assert len(result["steps"]) == 1
+
+
+def test_ndjson_writer_streams_results(stub_server):
+    """each probed result is appended as one compact JSON line"""
+    path = os.path.join(tempfile.mkdtemp(), "results.ndjson")
+    writer = NdjsonWriter(path)
+    endpoints = [
+        {"name": f"Ndjson {i}", "url": f"{stub_server}/health", "expected_status": 200,
+         "timeout": 5, "engine": "http"}
+        for i in range(3)
+    ]
+    RESULT_LISTENERS.append(writer.write)
+    try:
+        check_endpoints(endpoints, max_workers=3)
+    finally:
+        RESULT_LISTENERS.remove(writer.write)
+        writer.close()
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 3
+    assert ", " not in lines[0]
+    assert sorted(json.loads(line)["name"] for line in lines) == [e["name"] for e in endpoints]
+
+
+def test_anomaly_detector_flags_departure_from_baseline():
+    """a latency shift starts an anomaly, returning to baseline ends it"""
+    detector = AnomalyDetector()
+    baseline = [8.0, 10.0, 12.0, 9.0, 11.0]
+
+    events = [detector.update(baseline[i % 5]) for i in range(200)]
+    assert not any(events)
+
+    events = [detector.update(2000.0) for _ in range(5)]
+    assert events.count("anomaly") == 1
+    assert detector.anomalous == True
+
+    events = [detector.update(baseline[i % 5]) for i in range(100)]
+    assert events.count("recovered") == 1
+    assert detector.baseline_ms() < 20
+
+
+@patch('scripts.health_check.ANOMALY_DETECTION', True)
+def test_record_result_emits_anomaly_events():
+    """anomalies reach the event listeners as structured events"""
+    events = []
+    EVENT_LISTENERS.append(events.append)
+    try:
+        for i in range(60):
+            record_result({"name": "Anomalous", "url": "http://test.com/", "success": True,
+                           "response_time_ms": 10.0 + i % 3, "timestamp": "t"})
+        for _ in range(3):
+            record_result({"name": "Anomalous", "url": "http://test.com/", "success": True,
+                           "response_time_ms": 2000.0, "timestamp": "t"})
+    finally:
+        EVENT_LISTENERS.remove(events.append)
+
+    assert [e["event"] for e in events] == ["latency_anomaly"]
+    assert events[0]["name"] == "Anomalous"
+    assert events[0]["baseline_ms"] < 20
+
+
+@pytest.mark.parametrize("engine", ["requests", "http"])
+def test_conditional_get_not_modified(stub_server, engine):
+    """a conditional endpoint sends its last ETag back and passes on 304"""
+    endpoint = {
+        "name": f"Catalog {engine}",
+        "url": f"{stub_server}/api/catalog",
+        "expected_status": 200,
+        "timeout": 5,
+        "engine": engine,
+        "conditional": True
+    }
+
+    first = check_endpoint(endpoint)
+    record_result(first)
+    second = check_endpoint(endpoint)
+
+    assert first["status_code"] == 200
+    assert first["body_bytes"] == len(b'{"books": []}')
+    assert first["server_cpu_ms"] == 1.5
+    assert second["status_code"] == 304
+    assert second["success"] == True
+    assert second["not_modified"] == True
+    assert second["body_bytes"] == 0
+
+
+def test_async_head_probe(stub_server):
+    """HEAD probes read no body and keep the connection reusable"""
+    endpoints = [{
+        "name": "Head",
+        "url": f"{stub_server}/health",
+        "expected_status": 200,
+        "timeout": 5,
+        "method": "HEAD"
+    }]
+
+    async def run():
+        pool = AsyncConnectionPool(10)
+        try:
+            results = await async_run_health_checks(endpoints, pool=pool)
+            results += await async_run_health_checks(endpoints, pool=pool)
+            return results, pool.opened
+        finally:
+            pool.close()
+
+    results, opened = asyncio.run(run())
+
+    assert all(r["success"] for r in results)
+    assert all(r["body_bytes"] == 0 for r in results)
+    assert opened == 1
+
+
+def test_server_cpu_ms():
+    """the cpu metric of Server-Timing is picked out of the header"""
+    assert server_cpu_ms("db;dur=53, cpu;desc=\"CPU\";dur=2.4") == 2.4
+    assert server_cpu_ms("db;dur=53") is None
+    assert server_cpu_ms(None) is None
+
+
+def test_state_snapshot_warm_start():
+    """a saved monitor state restores baselines, breakers, last results and ETags"""
+    from scripts import health_check
+    name = "Warm start"
+    for i in range(40):
+        record_result({"name": name, "url": "http://test.com/", "success": True,
+                       "response_time_ms": 100.0 + i % 5, "timestamp": "t",
+                       "etag": '"v2"'})
+        get_detector(name).update(100.0 + i % 5)
+    breaker = get_breaker(name)
+    for _ in range(breaker.threshold):
+        breaker.record(False)
+    endpoint = {"name": name, "url": "http://test.com/", "timeout": 5, "adaptive_timeout": True}
+    timeout = effective_timeout(endpoint)
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as temp_file:
+        path = temp_file.name
+
+    try:
+        save_state(path)
+        with patch.dict(health_check.LATENCY_STATS, clear=True), \
+                patch.dict(health_check.BREAKERS, clear=True), \
+                patch.dict(health_check.DETECTORS, clear=True), \
+                patch.dict(health_check.VALIDATORS, clear=True), \
+                patch.dict(health_check.LAST_RESULTS, clear=True):
+            assert load_state(path) >= 1
+
+            assert effective_timeout(endpoint) == timeout < 5
+            assert get_stats(name).summary()["checks"] == 40
+            assert get_breaker(name).state == "open"
+            assert get_breaker(name).allow() == False
+            assert get_detector(name).samples == 40
+            assert get_detector(name).baseline_ms() == pytest.approx(102, rel=0.05)
+            assert health_check.VALIDATORS[name] == {"etag": '"v2"'}
+            assert health_check.LAST_RESULTS[name]["success"] == True
+    finally:
+        os.remove(path)
+    assert load_state(path) == 0  # missing file: cold start
+
+
+def test_circuit_breaker_restores_half_open_as_due():
+    """a breaker saved mid-trial gets a new trial after a restart"""
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=1, base_delay=10, clock=lambda: now[0])
+    breaker.record(False)
+    now[0] = 10.0
+    assert breaker.allow() == True
+    assert breaker.state == "half_open"
+
+    restored = CircuitBreaker.from_state(breaker.to_state(), elapsed=5)
+
+    assert restored.allow() == True
+    assert restored.state == "half_open"
+    assert restored.trips == 1
+
+
+def test_latency_stats_state_is_compact():
+    """only the last STATE_SAMPLES latencies are saved, without phase timings"""
+    stats = LatencyStats()
+    for i in range(150):
+        stats.add(i % 10 != 0, 10.0 + i, {"dns_ms": 0.1})
+
+    state = stats.to_state(last=100)
+    restored = LatencyStats.from_state(state)
+
+    assert len(state["ms"]) == len(state["ok"]) == 100
+    assert state["ms"][-1] == 159.0
+    assert restored.summary()["checks"] == 100
+    assert restored.summary()["success_ratio"] == 0.9
+    assert restored.summary()["phases"] == {}
+
+
+def test_dns_cache_ttl_and_refresh():
+    """lookups hit the cache within the TTL, names in use are refreshed ahead of expiry"""
+    now = [0.0]
+    lookups = []
+    def resolver(host, port, type=None):
+        if host == "flaky" and host in lookups:
+            raise OSError("resolver down")
+        lookups.append(host)
+        return [(2, 1, 6, "", (f"10.0.0.{len(lookups)}", port))]
+
+    cache = DnsCache(60, resolver=resolver, clock=lambda: now[0])
+    try:
+        first = cache.resolve("api", 80)
+        now[0] = 30.0
+        assert cache.resolve("api", 80) == first
+        now[0] = 50.0  # past 80% of the TTL, "api" is in use
+        assert cache.refresh() == 1
+        now[0] = 70.0
+        assert cache.resolve("api", 80) != first  # the refreshed entry, not a miss
+        assert lookups == ["api", "api"]
+        assert cache.hits == 2
+
+        # names nobody looks up any more are refreshed once, then expire
+        now[0] = 120.0
+        assert cache.refresh() == 1
+        now[0] = 190.0
+        assert cache.refresh() == 0
+        assert len(cache) == 0
+
+        # a failed refresh keeps the cached addresses
+        flaky = cache.resolve("flaky", 80)
+        now[0] = 240.0
+        assert cache.refresh() == 0
+        assert cache.resolve("flaky", 80) == flaky
+    finally:
+        cache.close()
+
+
+@patch('scripts.health_check.DNS_CACHE_TTL', 60)
+@patch('scripts.health_check.DNS_CACHE', None)
+def test_timed_engine_dns_cache(stub_server):
+    """with the DNS cache on, repeated probes skip the resolver"""
+    endpoint = {
+        "name": "Cached DNS",
+        "url": stub_server.replace("127.0.0.1", "localhost") + "/health",
+        "expected_status": 200,
+        "timeout": 5,
+        "engine": "timed"
+    }
+
+    results = [check_endpoint(endpoint) for _ in range(3)]
+
+    from scripts import health_check
+    assert all(r["success"] for r in results)
+    assert health_check.DNS_CACHE.misses == 1
+    assert health_check.DNS_CACHE.hits == 2
+    health_check.DNS_CACHE.close()
+
+
+@patch('scripts.health_check.DNS_CACHE_TTL', 60)
+@patch('scripts.health_check.DNS_CACHE', None)
+def test_requests_engine_dns_cache(stub_server):
+    """the requests engine resolves new connections through the DNS cache too"""
+    endpoint = {
+        "name": "Cached DNS requests",
+        "url": stub_server.replace("127.0.0.1", "localhost") + "/health",
+        "expected_status": 200,
+        "timeout": 5
+    }
+    pool = SessionPool()
+
+    results = [check_endpoint(endpoint)]
+    for _ in range(2):
+        results.append(check_endpoint(endpoint, pool.get(endpoint["url"])))
+        pool.close()  # the next probe needs a new connection
+
+    from scripts import health_check
+    assert all(r["success"] for r in results)
+    assert health_check.DNS_CACHE.misses == 1
+    assert health_check.DNS_CACHE.hits == 2
+    health_check.DNS_CACHE.close()
+
+
+def test_probe_dispatcher_round_robin():
+    """hosts take turns, a host at its limit is skipped"""
+    endpoints = [{"name": f"a{i}", "url": f"http://a:8000/{i}"} for i in range(4)]
+    endpoints += [{"name": f"b{i}", "url": f"http://b/{i}"} for i in range(2)]
+    dispatcher = ProbeDispatcher(endpoints, per_host=2)
+
+    taken = [dispatcher.take() for _ in range(4)]
+    assert [endpoint["name"] for _, _, endpoint in taken] == ["a0", "b0", "a1", "b1"]
+
+    dispatcher.done(("a", 8000))
+    host, index, endpoint = dispatcher.take()
+    assert (host, index, endpoint["name"]) == (("a", 8000), 2, "a2")
+
+
+def test_check_endpoints_per_host_limit():
+    """concurrent checks never exceed the per-host limit, results keep their order"""
+    endpoints = [{"name": f"busy{i}", "url": f"http://busy/{i}", "timeout": 5} for i in range(12)]
+    endpoints += [{"name": f"quiet{i}", "url": f"http://quiet/{i}", "timeout": 5} for i in range(3)]
+    in_flight, peak = {}, {}
+    lock = threading.Lock()
+
+    def fake_check(endpoint, session=None):
+        host = endpoint["url"].split("/")[2]
+        with lock:
+            in_flight[host] = in_flight.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), in_flight[host])
+        time.sleep(0.02)
+        with lock:
+            in_flight[host] -= 1
+        return {"name": endpoint["name"], "url": endpoint["url"], "success": True,
+                "response_time_ms": 20.0, "timestamp": "t"}
+
+    with patch('scripts.health_check.check_endpoint', side_effect=fake_check):
+        results = check_endpoints(endpoints, max_workers=10, per_host=3)
+
+    assert [r["name"] for r in results] == [e["name"] for e in endpoints]
+    assert peak["busy"] == 3
+    assert peak["quiet"] <= 3
+
+
+def test_async_run_health_checks_round_robin():
+    """async checks take turns across hosts, results keep their order"""
+    endpoints = [{"name": f"busy{i}", "url": f"http://busy/{i}", "timeout": 5} for i in range(8)]
+    endpoints += [{"name": f"quiet{i}", "url": f"http://quiet/{i}", "timeout": 5} for i in range(2)]
+    started, in_flight, peak = [], {}, {}
+
+    async def fake_check(endpoint, pool, limit=None):
+        host = endpoint["url"].split("/")[2]
+        started.append(endpoint["name"])
+        in_flight[host] = in_flight.get(host, 0) + 1
+        peak[host] = max(peak.get(host, 0), in_flight[host])
+        await asyncio.sleep(0.01)
+        in_flight[host] -= 1
+        return {"name": endpoint["name"], "url": endpoint["url"], "success": True,
+                "response_time_ms": 10.0, "timestamp": "t"}
+
+    with patch('scripts.health_check.async_check_endpoint', side_effect=fake_check):
+        results = asyncio.run(async_run_health_checks(endpoints, concurrency=4, per_host=2))
+
+    assert [r["name"] for r in results] == [e["name"] for e in endpoints]
+    assert started[:4] == ["busy0", "quiet0", "busy1", "quiet1"]
+    assert peak["busy"] == 2
+
+
+def test_stdlib_only_import_is_lean():
+    """with HEALTH_CHECK_STDLIB_ONLY, neither requests nor the async/sqlite/process machinery is imported"""
+    scripts = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+    code = (
+        f"import sys; sys.path.insert(0, {scripts!r}); import health_check; "
+        "print(sorted(m for m in ('requests', 'asyncio', 'sqlite3', 'multiprocessing', 'http.server') "
+        "if m in sys.modules))"
+    )
+    env = dict(os.environ, HEALTH_CHECK_STDLIB_ONLY="1")
+
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True,
+                            text=True, check=True).stdout
+
+    assert output.strip() == "[]"
+
+
+def test_tls_context_is_shared():
+    """the default TLS context (and its CA bundle) is loaded once, then reused"""
+    from scripts import health_check
+    with patch.object(health_check, 'TLS_CONTEXT', None), \
+            patch('scripts.health_check.ssl.create_default_context') as create:
+        first = health_check.get_tls_context()
+        assert health_check.get_tls_context() is first
+    assert create.call_count == 1
@@ -0,0 +1,78 @@
+import sys
+import os
+import tempfile
+import gzip
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scripts.log_analytics import analyze, parse_lines, EndpointHistory
+
+LOG_LINES = [
+    "[2025-12-12 10:00:00] [INFO] ✓ Library API - Health - Status: 200 - Response time: 10.0ms",
+    "[2025-12-12 10:01:00] [ERROR] ✗ Library API - Health - Timeout after 5s",
+    "[2025-12-12 10:02:00] [WARNING] ✗ Library API - Health - Expected 200, got 503",
+    "[2025-12-12 10:03:00] [INFO] ✓ Library API - Health - Status: 200 - Response time: 20.0ms",
+    "[2025-12-12 10:03:00] [INFO] Summary: 1/1 checks passed, 0 failed",
+    "[2025-12-12 10:04:00] [ERROR] ✗ Library API - Health - Connection refused",
+    "[2025-12-12 10:05:00] [INFO] ✓ Library API - Health - Status: 200 - Response time: 30.0ms",
+    "[2025-12-12 10:06:00] [ERROR] ✗ Library API - Health - Timeout after 5s",
+]
+
+
+def _write_log(lines, compress=False):
+    data = "".join(line + "\n" for line in lines).encode("utf-8")
+    suffix = ".log.gz" if compress else ".log"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+        temp_file.write(gzip.compress(data) if compress else data)
+        return temp_file.name
+
+
+def test_parse_lines_report():
+    """uptime, MTTR, failure kinds and latency percentiles per endpoint"""
+    histories, count = parse_lines(line.encode("utf-8") for line in LOG_LINES)
+
+    report = histories["Library API - Health"].report()
+
+    assert count == len(LOG_LINES)
+    assert report["checks"] == 7
+    assert report["uptime_pct"] == pytest.approx(3 / 7 * 100, abs=0.001)
+    assert report["incidents"] == 2
+    assert report["mttr_s"] == 90.0  # 120s and 60s outages
+    assert report["down_since"] == "2025-12-12 10:06:00"
+    assert report["failures"]["timeout"] == 2
+    assert report["failures"]["status"] == 1
+    assert report["failures"]["connection"] == 1
+    assert report["p50_ms"] == pytest.approx(20.0, rel=0.01)
+
+
+def test_analyze_merges_files_and_parts():
+    """gzip and split plain files give the same result as one sequential pass"""
+    rotated = _write_log(LOG_LINES[:3], compress=True)
+    current = _write_log(LOG_LINES[3:] * 50)
+    try:
+        whole, lines = analyze([current, rotated])
+        split, _ = analyze([current, rotated], chunk_size=512)
+
+        assert lines == 3 + 5 * 50
+        assert whole["Library API - Health"].report() == split["Library API - Health"].report()
+        assert whole["Library API - Health"].report()["incidents"] == 1 + 2 * 50 - 1
+    finally:
+        os.remove(rotated)
+        os.remove(current)
+
+
+def test_endpoint_history_outage_spanning_parts():
+    """an outage open at the end of one part closes in the next"""
+    first = EndpointHistory()
+    first.add(0, True, 5.0)
+    first.add(60, False, kind="timeout")
+    second = EndpointHistory()
+    second.add(120, False, kind="timeout")
+    second.add(300, True, 5.0)
+
+    first.merge(second)
+
+    assert first.incidents == 1
+    assert first.repair_seconds == 240
+    assert first.down_since is None